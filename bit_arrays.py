@@ -0,0 +1,90 @@
+# vim:set ts=4 sw=4 sts=4 expandtab:
+"""
+The bit_utils.py operations for NumPy arrays of (up to 10 bit) ints.
+
+The tables are NumPy copies of the ones in bit_utils.py, so the same value
+is a gather away for a whole array.
+"""
+
+import numpy as np
+
+from bit_utils import TABLE_BITS, TABLE_SIZE, _ONES, _TRANSITIONS, _BIAS
+
+
+# ONES_TABLE[x] is the number of set bits in x
+ONES_TABLE = np.array(_ONES, dtype=np.uint8)
+
+# TRANSITIONS_TABLE[x] is the number of transitions in x as a 10 bit sequence
+TRANSITIONS_TABLE = np.array(_TRANSITIONS, dtype=np.uint8)
+
+# BIAS_TABLE[x] is the bias of x as a 10 bit sequence
+BIAS_TABLE = np.array(_BIAS, dtype=np.int8)
+
+
+def ones_array(a):
+    """
+    >>> ones_array([0, 0b1011, 0x3ff]).tolist()
+    [0, 3, 10]
+    """
+    return ONES_TABLE[np.asarray(a)]
+
+
+def zeros_array(a, n=TABLE_BITS):
+    """
+    >>> zeros_array([0, 0b1011, 0x3ff]).tolist()
+    [10, 7, 0]
+    >>> zeros_array([0b1011], 4).tolist()
+    [1]
+    """
+    return n - ONES_TABLE[np.asarray(a)].astype(np.int16)
+
+
+def bias_array(a):
+    """
+    >>> bias_array([0, 0b0111110000, 0x3ff]).tolist()
+    [-10, 0, 10]
+    """
+    return BIAS_TABLE[np.asarray(a)]
+
+
+def transitions_array(a):
+    """
+    >>> transitions_array([0, 0b1101010100, 0b0000011111]).tolist()
+    [0, 7, 1]
+    """
+    return TRANSITIONS_TABLE[np.asarray(a)]
+
+
+def rotate_array(a, n=TABLE_BITS, dir="left"):
+    """Rotate n bit ints, the same as rotate_int().
+
+    >>> rotate_array([0b010, 0b100, 0b001], 3, "left").tolist()
+    [1, 2, 4]
+    >>> rotate_array([0b010, 0b100, 0b001], 3, "right").tolist()
+    [4, 1, 2]
+    >>> from bit_utils import rotate_int
+    >>> codes = np.arange(TABLE_SIZE)
+    >>> assert rotate_array(codes).tolist() == [rotate_int(c) for c in range(TABLE_SIZE)]
+    """
+    a = np.asarray(a)
+    mask = (1 << n) - 1
+    if dir in ("left", "<"):
+        return (a >> 1) | ((a & 1) << (n - 1))
+    elif dir in ("right", ">"):
+        return ((a << 1) & mask) | (a >> (n - 1))
+    return a
+
+
+def hamming_array(a, b):
+    """
+    >>> hamming_array([0, 0b11], [0x3ff, 0b10]).tolist()
+    [10, 1]
+    """
+    return ONES_TABLE[np.bitwise_xor(a, b) & (TABLE_SIZE - 1)]
+
+
+if __name__ == "__main__":
+    import doctest
+    results = doctest.testmod()
+    assert results.failed == 0
+    assert results.attempted > 0
@@ -1,8 +1,17 @@
 # vim:set ts=4 sw=4 sts=4 expandtab:
 """
 Utils for doing operations with bit sequences in Python.
+
+Bit sequences are lists (or tuples) of 0/1 values, element 0 being the least
+significant bit when converted to an int (see bits() / bint()).
+
+The *_int functions do the same operations directly on ints, values of up
+to 10 bits (IE TMDS symbols) being looked up in precomputed tables. The
+versions for NumPy arrays are in bit_arrays.py, so importing this doesn't
+import NumPy.
 """
 
+
 def bits(x, n=8):
     """Convert an int into a bit sequence.
 
@@ -25,9 +34,8 @@ def bits(x, n=8):
     AssertionError
     """
     assert isinstance(x, int)
-    blist = [int(bit) for bit in reversed("{0:0{n}b}".format(x, n=n))]
-    assert len(blist) == n
-    return blist
+    assert 0 <= x < (1 << n)
+    return [(x >> i) & 1 for i in range(n)]
 
 
 def bint(x):
@@ -40,7 +48,10 @@ def bint(x):
     >>> assert bint([0,1]) == 2
     """
     assert isinstance(x, (tuple, list))
-    return int("0b"+bstr(x)[::-1], 2)
+    v = 0
+    for i, b in enumerate(x):
+        v |= b << i
+    return v
 
 
 def rotate(b,dir="left"):
@@ -75,12 +86,7 @@ def xor(a, b):
     >>> assert xor(1, 0) == 1
     >>> assert xor(1, 1) == 0
     """
-    assert a in (0, 1)
-    assert b in (0, 1)
-    if a == b:
-        return 0
-    else:
-        return 1
+    return a ^ b
 
 
 def xnor(a, b):
@@ -91,12 +97,7 @@ def xnor(a, b):
     >>> assert xnor(1, 0) == 0
     >>> assert xnor(1, 1) == 1
     """
-    assert a in (0, 1)
-    assert b in (0, 1)
-    if a == b:
-        return 1
-    else:
-        return 0
+    return 1 ^ a ^ b
 
 
 def inv(bits):
@@ -137,11 +138,7 @@ def transitions(bits):
     >>> assert transitions([1, 1, 1]) == 0
     >>> assert transitions([1, 0, 1]) == 2
     """
-    transitions = 0
-    for i in range(0, len(bits)-1):
-        if bits[i] != bits[i+1]:
-            transitions += 1
-    return transitions
+    return transitions_int(*_as_int(bits))
 
 
 def hamming(a, b):
@@ -153,7 +150,7 @@ def hamming(a, b):
     >>> assert hamming((0, 0), (0, 1)) == 1
     >>> assert hamming((0, 0), (0, 0)) == 0
     """
-    return sum(xor(b1, b2) for b1, b2 in zip(a, b))
+    return hamming_int(_as_int(a)[0], _as_int(b)[0])
 
 
 def ones(a):
@@ -167,7 +164,7 @@ def ones(a):
     >>> assert ones([1, 1, 1, 0, 1]) == 4
     >>> assert ones([0, 1, 0, 0, 0]) == 1
     """
-    return sum(a)
+    return ones_int(_as_int(a)[0])
 
 
 def zeros(a):
@@ -181,7 +178,7 @@ def zeros(a):
     >>> assert zeros([1, 1, 1, 0, 1]) == 1
     >>> assert zeros([0, 1, 0, 0, 0]) == 4
     """
-    return sum(inv(a))
+    return zeros_int(*_as_int(a))
 
 
 def bias(a):
@@ -198,7 +195,120 @@ def bias(a):
     >>> assert bias([0, 0, 0]) == 2
     >>> assert bias([0, 0, 1]) == 2
     """
-    return ones(a) - zeros(a)
+    return bias_int(*_as_int(a))
+
+
+def _as_int(a):
+    """Return (value, n) for a bit sequence.
+
+    BitSequence objects (see tmds_tokens.py) already know their value.
+    """
+    try:
+        return a.value, a.n
+    except AttributeError:
+        return bint(a), len(a)
+
+
+# --
+# Operations on ints
+
+TABLE_BITS = 10
+TABLE_SIZE = 1 << TABLE_BITS
+
+# _ONES[x] is the number of set bits in x
+_ONES = [0] * TABLE_SIZE
+for _i in range(1, TABLE_SIZE):
+    _ONES[_i] = _ONES[_i >> 1] + (_i & 1)
+del _i
+
+# _TRANSITIONS[x] is the number of transitions in x as a 10 bit sequence
+_TRANSITIONS = [_ONES[(x ^ (x >> 1)) & ((TABLE_SIZE >> 1) - 1)] for x in range(TABLE_SIZE)]
+
+# _BIAS[x] is the bias of x as a 10 bit sequence
+_BIAS = [2 * o - TABLE_BITS for o in _ONES]
+
+
+def ones_int(x):
+    """
+    Return the number of set bits in an int.
+
+    >>> assert ones_int(0b0) == 0
+    >>> assert ones_int(0b1011) == 3
+    >>> assert ones_int(0x3ff) == 10
+    >>> assert ones_int(0xfff) == 12
+    """
+    if x < TABLE_SIZE:
+        return _ONES[x]
+    return bin(x).count("1")
+
+
+def zeros_int(x, n=TABLE_BITS):
+    """
+    Return the number of cleared bits in an n bit int.
+
+    >>> assert zeros_int(0b1011, 4) == 1
+    >>> assert zeros_int(0b1011) == 7
+    """
+    return n - ones_int(x)
+
+
+def bias_int(x, n=TABLE_BITS):
+    """
+    Return the bias (ones - zeros) of an n bit int.
+
+    >>> assert bias_int(0b11, 2) == 2
+    >>> assert bias_int(0b00, 2) == -2
+    >>> assert bias_int(0b0111110000) == 0
+    >>> assert bias_int(0x3ff) == 10
+    """
+    if n == TABLE_BITS and x < TABLE_SIZE:
+        return _BIAS[x]
+    return 2 * ones_int(x) - n
+
+
+def transitions_int(x, n=TABLE_BITS):
+    """
+    Return the number of transitions in an n bit int.
+
+    >>> assert transitions_int(0b010, 3) == 2
+    >>> assert transitions_int(0b110, 3) == 1
+    >>> assert transitions_int(0b1101010100) == 7
+    >>> assert transitions_int(0b1101010100, 8) == 6
+    """
+    if n == TABLE_BITS and x < TABLE_SIZE:
+        return _TRANSITIONS[x]
+    if n < 2:
+        return 0
+    return ones_int((x ^ (x >> 1)) & ((1 << (n - 1)) - 1))
+
+
+def hamming_int(a, b):
+    """
+    Return the hamming distance between two ints.
+
+    >>> assert hamming_int(0b00, 0b11) == 2
+    >>> assert hamming_int(0b1101010100, 0b0010101011) == 10
+    """
+    return ones_int(a ^ b)
+
+
+def rotate_int(x, n=TABLE_BITS, dir="left"):
+    """Rotate an n bit int, the same way rotate() moves the bit sequence.
+
+    Rotating "left" moves every element of the sequence one index lower, so
+    it is a right shift of the int.
+
+    >>> assert rotate_int(bint([0,1,0]), 3, "left") == bint([1,0,0])
+    >>> assert rotate_int(bint([1,0,0]), 3, "left") == bint([0,0,1])
+    >>> assert rotate_int(bint([0,1,0]), 3, "right") == bint([0,0,1])
+    >>> assert rotate_int(bint([0,0,1]), 3, "right") == bint([1,0,0])
+    """
+    mask = (1 << n) - 1
+    if dir in ("left", "<"):
+        return (x >> 1) | ((x & 1) << (n - 1))
+    elif dir in ("right", ">"):
+        return ((x << 1) & mask) | (x >> (n - 1))
+    return x
 
 
 if __name__ == "__main__":
@@ -587,21 +587,6 @@ def generate_encodings(data_int):
     return list(encodings)
 
 
-def token_min_distance(token, other_tokens):
-    min_distance = len(token)+1
-
-    close_tokens = None
-    for otoken in other_tokens:
-        distance = hamming(token, otoken)
-        if distance < min_distance:
-            min_distance = distance
-            close_tokens = [otoken]
-        elif distance == min_distance:
-            close_tokens.append(otoken)
-
-    return min_distance, close_tokens
-
-
 def main(args):
 
     seen_encodings = set()
@@ -726,32 +711,37 @@ def main(args):
     # --------------------------------------------------------------------
     # --------------------------------------------------------------------
 
+    # The distances are worked out for all the codes at once. (Imported
+    # here so importing this module doesn't pull in NumPy.)
+    from tmds_analysis import CodeSpace
+    code_space = CodeSpace.build(
+        [bint(e) for e in data_encoding_rmap],
+        [bint(e) for e in ctrl_encoding_rmap],
+        )
+    assert [tuple(bits(n.code, 10)) for n in code_space.forbidden] == sorted(forbidden)
+
+    def bstr10(code):
+        return bstr(bits(code, 10))
+
     print()
     print("Forbidden tokens distance:")
 
-    forbidden_really = []
-    forbidden_correctable = []
-
     # See how many valid tokens are equally distant away from the forbidden token
-    for encoding in sorted(forbidden):
-        min_distance, encodings = token_min_distance(encoding, seen_encodings)
-
+    for n in code_space.forbidden:
         if True:
             extra = "           "
-        if min_distance > 1:
-            forbidden_really.append(encoding)
+        if n.distance > 1:
             extra = "REALLY FORB"
-        if len(encodings) == 1:
-            forbidden_correctable.append(encoding)
+        if len(n.symbols) == 1:
             extra = "CORRECTABLE"
 
-        assert encodings
-        print(bstr(encoding), min_distance, extra, [bstr(e) for e in sorted(encodings)])
+        assert n.symbols
+        print(bstr10(n.code), n.distance, extra, [bstr10(e) for e in n.symbols])
 
     print()
     print(" {} correctable (out of {} - {}%), {} very forbidden".format(
-        len(forbidden_correctable), len(forbidden), int(len(forbidden_correctable)/len(forbidden)*100.0),
-        len(forbidden_really)))
+        len(code_space.correctable), len(forbidden), int(len(code_space.correctable)/len(forbidden)*100.0),
+        len(code_space.really_forbidden)))
 
     print()
     print()
@@ -761,22 +751,18 @@ def main(args):
 
     print("Control tokens distance:")
     # See how far away the ctrl tokens are from other valid tokens
-    for encoding in sorted(ctrl_encoding_rmap):
-        min_distance, encodings = token_min_distance(encoding, data_encoding_rmap)
-
-        assert encodings
-        print(bstr(encoding), min_distance, [bstr(e) for e in sorted(encodings)])
+    for n in code_space.control_distances:
+        assert n.symbols
+        print(bstr10(n.code), n.distance, [bstr10(e) for e in n.symbols])
 
 
     print()
     print("Rotated control tokens:")
-    for encoding in sorted(ctrl_encoding_rmap):
-        print(bstr(encoding))
-        for i in range(1, len(encoding)):
-            encoding = rotate(encoding)
-            min_distance, encodings = token_min_distance(encoding, data_encoding_rmap)
-            assert encodings
-            print(bstr(encoding), min_distance, [bstr(e) for e in sorted(encodings)])
+    for encoding, rotations in zip(code_space.control, code_space.rotations):
+        print(bstr10(encoding))
+        for n in rotations:
+            assert n.symbols
+            print(bstr10(n.code), n.distance, [bstr10(e) for e in n.symbols])
         print()
     print()
     print()
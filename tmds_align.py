@@ -0,0 +1,174 @@
+# vim:set ts=4 sw=4 sts=4 expandtab:
+"""
+TMDS Alignment
+
+Finding the symbol (word) boundaries in a raw TMDS bit stream using the
+control tokens sent during blanking. This is the Python version of
+`tmds_detect_alignment` in tmds.c.
+
+Bit streams are packed LSB first, IE bit n of the stream is
+`(stream[n // 8] >> (n % 8)) & 1`, so a 10 bit symbol at a boundary reads
+back as the same integer as `bint()` of its bit sequence.
+"""
+
+import os
+
+import numpy as np
+
+import tmds_tokens
+
+
+# Returned when no alignment could be found (same as tmds_detect_alignment).
+NO_ALIGNMENT = -1
+
+WINDOW_BITS = 20
+
+
+def _control_symbols():
+    return [int(t) for t in tmds_tokens.ControlToken.tokens()]
+
+
+def build_alignment_table():
+    """Build the 2**20 entry window -> phase table.
+
+    A window is 20 consecutive bits from the stream. If the window could only
+    have come from the middle of a run of control tokens, the entry is the
+    number of bits from the start of the window to the next symbol boundary
+    (0-9), otherwise it is NO_ALIGNMENT.
+
+    An entry of 0 means the window is exactly two control tokens, which is
+    what tmds_detect_alignment looks for.
+    """
+    ctrl = _control_symbols()
+    table = np.full(2**WINDOW_BITS, NO_ALIGNMENT, dtype=np.int8)
+    for a in ctrl:
+        for b in ctrl:
+            for c in ctrl:
+                run = a | (b << 10) | (c << 20)
+                for phase in range(10):
+                    window = (run >> (10 - phase)) & (2**WINDOW_BITS - 1)
+                    assert table[window] in (NO_ALIGNMENT, phase), (window, phase)
+                    table[window] = phase
+    return table
+
+
+_alignment_table = None
+
+def alignment_table(filename=None):
+    """Return the window -> phase table (see build_alignment_table).
+
+    If filename is given the table is stored there (in .npy format) the
+    first time and memory mapped on later calls, so a pool of processes can
+    share a single copy.
+
+    >>> t = alignment_table()
+    >>> ctrl = _control_symbols()
+    >>> int(t[ctrl[0] | (ctrl[3] << 10)])
+    0
+    >>> int(t[((ctrl[1] | (ctrl[1] << 10) | (ctrl[1] << 20)) >> 7) & 0xfffff])
+    3
+    >>> int(t[0]) == NO_ALIGNMENT
+    True
+    """
+    global _alignment_table
+    if filename is not None:
+        if not os.path.exists(filename):
+            np.save(filename, alignment_table())
+        return np.load(filename, mmap_mode='r')
+
+    if _alignment_table is None:
+        _alignment_table = build_alignment_table()
+    return _alignment_table
+
+
+def detect_alignment(window):
+    """Return the phase for a single 20 bit window.
+
+    >>> ctrl = _control_symbols()
+    >>> detect_alignment(ctrl[2] | (ctrl[2] << 10))
+    0
+    >>> detect_alignment(0x12345)
+    -1
+    """
+    return int(alignment_table()[window & (2**WINDOW_BITS - 1)])
+
+
+def _windows(block):
+    """Return the 20 bit windows at every bit offset in a block of bytes.
+
+    The result has shape (len(block) - 3, 8), row n being the windows
+    starting at bits 0..7 of byte n.
+    """
+    b = block.astype(np.uint32)
+    words = b[:-3] | (b[1:-2] << 8) | (b[2:-1] << 16) | (b[3:] << 24)
+    shifts = np.arange(8, dtype=np.uint32)
+    return (words[:, None] >> shifts) & (2**WINDOW_BITS - 1)
+
+
+def find_control_pairs(stream, block_size=2**20, table=None):
+    """Find every bit offset in a packed stream where two control tokens start.
+
+    stream can be bytes, a uint8 array or a np.memmap of a capture; it is
+    processed block_size bytes at a time. Returns a sorted int64 array of bit
+    offsets.
+
+    >>> ctrl = _control_symbols()
+    >>> run = 0
+    >>> for i, c in enumerate([ctrl[0], ctrl[1], ctrl[3]]):
+    ...     run |= c << (5 + 10 * i)
+    >>> find_control_pairs(run.to_bytes(5, "little")).tolist()
+    [5, 15]
+    >>> find_control_pairs(run.to_bytes(5, "little"), block_size=1).tolist()
+    [5, 15]
+
+    Including a pair which ends exactly at the end of the stream.
+    >>> pair = ctrl[0] | (ctrl[1] << 10)
+    >>> find_control_pairs((pair << 4).to_bytes(3, "little")).tolist()
+    [4]
+    >>> find_control_pairs((pair << 12).to_bytes(4, "little"), block_size=2).tolist()
+    [12]
+    """
+    if table is None:
+        table = alignment_table()
+    stream = np.frombuffer(stream, dtype=np.uint8) if isinstance(stream, (bytes, bytearray)) else stream
+
+    found = []
+    for start in range(0, len(stream), block_size):
+        # Windows starting in this block need up to 3 bytes from the next,
+        # zero padded at the end of the stream
+        rows = min(block_size, len(stream) - start)
+        block = np.asarray(stream[start:start + rows + 3])
+        if len(block) < rows + 3:
+            block = np.concatenate((block, np.zeros(rows + 3 - len(block), dtype=np.uint8)))
+        byte, shift = np.nonzero(table[_windows(block)] == 0)
+        found.append((start + byte.astype(np.int64)) * 8 + shift)
+
+    if not found:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.concatenate(found)
+    # Drop windows which ran into the padding
+    return offsets[offsets + WINDOW_BITS <= 8 * len(stream)]
+
+
+def find_alignment(stream, **kw):
+    """Return the symbol phase (bit offset modulo 10) of a packed stream.
+
+    The most common phase of the control token pairs is used, or
+    NO_ALIGNMENT if there are none.
+
+    >>> ctrl = _control_symbols()
+    >>> run = sum(c << (7 + 10 * i) for i, c in enumerate(ctrl))
+    >>> find_alignment(run.to_bytes(6, "little"))
+    7
+    """
+    offsets = find_control_pairs(stream, **kw)
+    if not len(offsets):
+        return NO_ALIGNMENT
+    return int(np.bincount(offsets % 10, minlength=10).argmax())
+
+
+if __name__ == "__main__":
+    import doctest
+    results = doctest.testmod()
+    assert results.failed == 0
+    assert results.attempted > 0
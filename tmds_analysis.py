@@ -0,0 +1,168 @@
+# vim:set ts=4 sw=4 sts=4 expandtab:
+"""
+TMDS Code Space Analysis
+
+How far apart the 10 bit codes are from each other, worked out for the
+whole code space at once from a 1024x1024 Hamming distance matrix (XOR of
+every pair of codes plus a popcount table) rather than bit by bit.
+
+This is what the distance tables printed by tmds_8b10.py are made from.
+Codes are ints with the same bit ordering as `bits()` / `bint()`.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+from bit_arrays import ONES_TABLE
+from bit_utils import rotate_int
+
+
+_hamming_matrix = None
+
+def hamming_matrix():
+    """Return the (1024, 1024) matrix of Hamming distances between codes.
+
+    >>> m = hamming_matrix()
+    >>> int(m[0b0000000000, 0b1111111111]), int(m[0b0101010100, 0b1101010100])
+    (10, 1)
+    """
+    global _hamming_matrix
+    if _hamming_matrix is None:
+        codes = np.arange(2**10, dtype=np.uint16)
+        _hamming_matrix = ONES_TABLE[codes[:, None] ^ codes[None, :]]
+        _hamming_matrix.flags.writeable = False
+    return _hamming_matrix
+
+
+def report_order(codes):
+    """Sort codes the way tmds_8b10.py does, IE by their bit sequence.
+
+    >>> report_order([0b01, 0b10, 0b11])
+    [2, 1, 3]
+    """
+    return sorted(codes, key=lambda c: "{:010b}".format(c)[::-1])
+
+
+def nearest_mask(codes, candidates):
+    """Return (distance, closest) for the nearest candidates to each code.
+
+    distance[i] is the smallest distance from codes[i] to any candidate and
+    closest[i, j] is True if candidates[j] is at that distance.
+
+    >>> distance, closest = nearest_mask([0b0000000011], [0b0000000001, 0b0000000010, 0b1111111111])
+    >>> distance.tolist(), closest.tolist()
+    ([1], [[True, True, False]])
+    """
+    codes = np.asarray(codes, dtype=np.uint16)
+    candidates = np.asarray(candidates, dtype=np.uint16)
+    distances = hamming_matrix()[codes[:, None], candidates[None, :]]
+    distance = distances.min(axis=1)
+    return distance, distances == distance[:, None]
+
+
+Nearest = namedtuple("Nearest", ["code", "distance", "symbols"])
+
+
+def nearest(codes, candidates):
+    """Return a Nearest(code, distance, symbols) for each code.
+
+    symbols is the tuple of candidates at the minimum distance from code (in
+    report order).
+
+    >>> nearest([0b0000000011], [0b0000000001, 0b0000000010, 0b1111111111])
+    [Nearest(code=3, distance=1, symbols=(2, 1))]
+    """
+    codes = np.asarray(codes, dtype=np.uint16)
+    candidates = np.asarray(report_order(candidates), dtype=np.uint16)
+    minimum, closest = nearest_mask(codes, candidates)
+    return [
+        Nearest(int(c), int(d), tuple(candidates[row].tolist()))
+        for c, d, row in zip(codes, minimum, closest)]
+
+
+_CodeSpaceBase = namedtuple("CodeSpace", ["data", "control", "forbidden", "control_distances", "rotations"])
+class CodeSpace(_CodeSpaceBase):
+    """Distances between the valid and forbidden parts of the code space.
+
+    data              - The data symbols.
+    control           - The control symbols.
+    forbidden         - Nearest valid symbols for each forbidden code.
+    control_distances - Nearest data symbols for each control symbol.
+    rotations         - For each control symbol, the nearest data symbols to
+                        it rotated left by 1 to 9 bits.
+
+    Everything is in report order.
+
+    >>> cs = analysis()
+    >>> len(cs.data), len(cs.control), len(cs.forbidden)
+    (460, 4, 560)
+    >>> len(cs.correctable), len(cs.really_forbidden)
+    (60, 48)
+    >>> [n.distance for n in cs.control_distances]
+    [2, 2, 2, 2]
+    >>> len(cs.rotations[0]), cs.rotations[0][0].code == rotate_int(cs.control[0])
+    (9, True)
+
+    The same codes the decoder corrects (or gives up on).
+    >>> import tmds_decoder
+    >>> status = (tmds_decoder.correction_table() >> 10).tolist()
+    >>> sorted(n.code for n in cs.correctable) == [c for c, s in enumerate(status) if s == tmds_decoder.SYMBOL_CORRECTED]
+    True
+    >>> sorted(n.code for n in cs.really_forbidden) == [c for c, s in enumerate(status) if s == tmds_decoder.SYMBOL_UNCORRECTABLE]
+    True
+    """
+
+    @classmethod
+    def build(cls, data, control):
+        data = report_order(data)
+        control = report_order(control)
+        valid = set(data) | set(control)
+        forbidden = [c for c in report_order(range(2**10)) if c not in valid]
+
+        rotations = []
+        for c in control:
+            rotated = []
+            for i in range(1, 10):
+                c = rotate_int(c)
+                rotated.append(c)
+            rotations.append(nearest(rotated, data))
+
+        return cls(
+            data,
+            control,
+            nearest(forbidden, data + control),
+            nearest(control, data),
+            rotations,
+            )
+
+    @property
+    def correctable(self):
+        """Forbidden codes with only one valid symbol a single bit away."""
+        return [n for n in self.forbidden if n.distance == 1 and len(n.symbols) == 1]
+
+    @property
+    def really_forbidden(self):
+        """Forbidden codes more than a bit away from any valid symbol."""
+        return [n for n in self.forbidden if n.distance > 1]
+
+
+_analysis = None
+
+def analysis():
+    """Return the (cached) CodeSpace for the tokens in tmds_tokens.py."""
+    global _analysis
+    if _analysis is None:
+        import tmds_tokens
+        _analysis = CodeSpace.build(
+            [int(t) for t in tmds_tokens.DataToken.tokens()],
+            [int(t) for t in tmds_tokens.ControlToken.tokens()],
+            )
+    return _analysis
+
+
+if __name__ == "__main__":
+    import doctest
+    results = doctest.testmod()
+    assert results.failed == 0
+    assert results.attempted > 0
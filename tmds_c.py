@@ -15,16 +15,7 @@ struct tmds_token_encoded_choice tmds_pixel_to_encoded[0xff+1] = {
 """)
 
     for i in range(0, 256):
-        tokens = list(tmds_tokens.DataToken.mapping(i))
-
-        if len(tokens) == 1:
-            negative = tokens[0]
-            positive = tokens[0]
-        else:
-            if bias(tokens[0]) > bias(tokens[1]):
-                positive, negative = tokens
-            else:
-                negative, positive = tokens
+        negative, positive = tmds_tokens.DataToken.choice(i)
 
         s.append("""\
     [0x{:02x}] = {{
@@ -34,9 +25,6 @@ struct tmds_token_encoded_choice tmds_pixel_to_encoded[0xff+1] = {
         }},
 """.format(i, positive, *positive, bias=bias(positive)))
 
-        if len(tokens) == 1:
-            tokens.append(tokens[0])
-
         s.append("""\
         /* {!r} */
         .negative = {{
@@ -62,9 +50,8 @@ struct tmds_token tmds_encoded_to_token[MASK_10BIT+1] = {
 """)
 
     for i in range(0, 2**10):
-        bi = bits(i, n=10)
-        try:
-            token = tmds_tokens.DataToken.rmapping(bi)
+        token = tmds_tokens.TMDSToken.lookup(i)
+        if isinstance(token, tmds_tokens.DataToken):
             s.append("""\
     [0x{:03x}] = {{ 
         /* {!r} */
@@ -75,11 +62,8 @@ struct tmds_token tmds_encoded_to_token[MASK_10BIT+1] = {
     }},
 """.format(i, token, token.data))
             continue
-        except AssertionError:
-            pass
 
-        try:
-            token = tmds_tokens.ControlToken.rmapping(bi)
+        if isinstance(token, tmds_tokens.ControlToken):
             s.append("""\
     [0x{:x}] = {{ 
         /* {!r} */
@@ -91,8 +75,6 @@ struct tmds_token tmds_encoded_to_token[MASK_10BIT+1] = {
     }},
 """.format(i, token, c0=token.c0, c1=token.c1))
             continue
-        except AssertionError:
-            pass
 
         s.append("""\
     [0x{:x}] = {{
@@ -0,0 +1,201 @@
+# vim:set ts=4 sw=4 sts=4 expandtab:
+"""
+TMDS Capture Files
+
+Reading raw serial captures from deserializers without loading them into
+memory. The file is memory mapped and symbols are handed out as NumPy arrays
+a block at a time.
+
+Supported layouts;
+
+ * "u16"      - Each 10 bit word in the low bits of a little endian 16 bit
+                word. The top 6 bits are ignored, but are left in the zero
+                copy views returned for a phase of 0.
+ * "packed10" - A continuous LSB first bit stream, IE 4 symbols every 5
+                bytes (see tmds_packed.py).
+
+Either layout can hold a single channel or several channels interleaved
+symbol by symbol (channel 0, 1, 2, 0, 1, 2, ...).
+
+ * "packed30" - Three channels in each 32 bit word (see tmds_packed.py).
+
+If the capture wasn't word aligned, phase gives the bit offset of the first
+symbol boundary (see detect_phase).
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+from tmds_align import find_alignment
+from tmds_packed import unpack_stream, unpack30
+
+
+LAYOUTS = ("u16", "packed10", "packed30")
+
+
+CaptureBlock = namedtuple("CaptureBlock", ["start", "channels"])
+
+
+class CaptureReader:
+    """Memory mapped reader for a capture file.
+
+    >>> import os, tempfile
+    >>> symbols = np.arange(30, dtype='<u2') * 31
+
+    Three interleaved channels of 16 bit words.
+    >>> with tempfile.TemporaryDirectory() as d:
+    ...     fn = os.path.join(d, "capture.bin")
+    ...     symbols.tofile(fn)
+    ...     r = CaptureReader(fn, channels=3)
+    ...     blocks = list(r.blocks(4))
+    ...     del r
+    >>> [(b.start, len(b.channels[0])) for b in blocks]
+    [(0, 4), (4, 4), (8, 2)]
+    >>> blocks[0].channels[1].tolist()
+    [31, 124, 217, 310]
+
+    The same symbols as a packed 10 bit stream, starting 3 bits in.
+    >>> v = sum(int(s) << (3 + 10 * i) for i, s in enumerate(symbols))
+    >>> with tempfile.TemporaryDirectory() as d:
+    ...     fn = os.path.join(d, "capture.bin")
+    ...     with open(fn, "wb") as f:
+    ...         _ = f.write(v.to_bytes(39, "little"))
+    ...     r = CaptureReader(fn, layout="packed10", channels=3, phase=3)
+    ...     packed = list(r.blocks(4))
+    ...     del r
+    >>> all((a == b).all() for p, u in zip(packed, blocks) for a, b in zip(p.channels, u.channels))
+    True
+
+    And as 30 bits in 32.
+    >>> import tmds_packed
+    >>> with tempfile.TemporaryDirectory() as d:
+    ...     fn = os.path.join(d, "capture.bin")
+    ...     tmds_packed.pack30(*symbols.reshape(-1, 3).T).tofile(fn)
+    ...     r = CaptureReader(fn, layout="packed30", channels=3)
+    ...     packed = list(r.blocks(4))
+    ...     del r
+    >>> all((a == b).all() for p, u in zip(packed, blocks) for a, b in zip(p.channels, u.channels))
+    True
+    """
+
+    def __init__(self, filename, layout="u16", channels=1, phase=0):
+        assert layout in LAYOUTS, layout
+        assert channels >= 1
+        assert 0 <= phase < 10
+
+        self.layout = layout
+        self.channels = channels
+        self.phase = phase
+
+        if layout == "u16":
+            self._data = np.memmap(filename, dtype='<u2', mode='r')
+        elif layout == "packed30":
+            assert channels == 3 and phase == 0
+            self._data = np.memmap(filename, dtype='<u4', mode='r')
+        else:
+            self._data = np.memmap(filename, dtype=np.uint8, mode='r')
+
+    def __len__(self):
+        """Number of symbols in each channel."""
+        if self.layout == "u16":
+            n = len(self._data) // self.channels
+            if self.phase:
+                # Each symbol needs part of the next word
+                n -= 1
+            return max(n, 0)
+        elif self.layout == "packed30":
+            return len(self._data)
+        else:
+            return max((len(self._data) * 8 - self.phase) // 10 // self.channels, 0)
+
+    def raw_channel(self, n):
+        """Zero copy (strided) view of every word of a channel ("u16" only)."""
+        assert self.layout == "u16"
+        words = self._data[:len(self._data) - len(self._data) % self.channels]
+        return words.reshape(-1, self.channels)[:, n]
+
+    def read(self, start, count):
+        """Return a tuple of arrays with count symbols per channel from start.
+
+        For "u16" captures with a phase of 0 these are views into the file,
+        so still have the top 6 bits of each word.
+
+        >>> import os, tempfile
+        >>> symbols = np.arange(8) * 127
+        >>> v = sum(int(s) << (3 + 10 * i) for i, s in enumerate(symbols))
+        >>> words = np.array([((v >> (10 * i)) & 0x3ff) | 0xfc00 for i in range(9)], dtype='<u2')
+        >>> with tempfile.TemporaryDirectory() as d:
+        ...     fn = os.path.join(d, "capture.bin")
+        ...     words.tofile(fn)
+        ...     r = CaptureReader(fn, phase=3)
+        ...     channel, = r.read(0, 8)
+        ...     del r
+        >>> assert channel.tolist() == symbols.tolist()
+        """
+        count = max(min(count, len(self) - start), 0)
+        if self.layout == "u16":
+            channels = []
+            for n in range(self.channels):
+                words = self.raw_channel(n)
+                if not self.phase:
+                    channels.append(words[start:start + count])
+                else:
+                    lo = (words[start:start + count] & 0x3ff) >> self.phase
+                    hi = (words[start + 1:start + count + 1] & 0x3ff) << (10 - self.phase)
+                    channels.append((lo | hi) & 0x3ff)
+            return tuple(channels)
+
+        if self.layout == "packed30":
+            return unpack30(self._data[start:start + count])
+
+        first_bit = self.phase + 10 * start * self.channels
+        last_bit = self.phase + 10 * (start + count) * self.channels
+        buf = self._data[first_bit // 8:(last_bit + 7) // 8]
+        symbols = unpack_stream(buf, count * self.channels, first_bit % 8)
+        return tuple(symbols[n::self.channels] for n in range(self.channels))
+
+    def blocks(self, block_size=2**20):
+        """Yield CaptureBlock(start, channels) covering the whole capture."""
+        for start in range(0, len(self), block_size):
+            yield CaptureBlock(start, self.read(start, block_size))
+
+
+def detect_phase(filename, layout="u16", channels=1, channel=0, nbytes=2**20):
+    """Find the symbol phase of a capture from its control tokens.
+
+    Looks at the first nbytes of the file. Returns NO_ALIGNMENT if no control
+    tokens were found.
+
+    All channels send control tokens during blanking, so for "packed10" the
+    interleaved stream can be searched as is. For "u16" the bit stream of
+    the given channel is rebuilt from its words. "packed30" captures are
+    always aligned (phase 0), so aren't searched.
+
+    >>> import os, tempfile, tmds_encoder
+    >>> ctrl = tmds_encoder.encode_control(0, 1)
+    >>> bits = [(ctrl >> i) & 1 for i in range(10)] * 20
+    >>> words = np.packbits(np.array(bits[6:], dtype=np.uint8), bitorder='little')
+    >>> with tempfile.TemporaryDirectory() as d:
+    ...     fn = os.path.join(d, "capture.bin")
+    ...     words.tofile(fn)
+    ...     detect_phase(fn, layout="packed10")
+    4
+    """
+    assert layout != "packed30", layout
+    r = CaptureReader(filename, layout=layout, channels=channels)
+    if layout == "u16":
+        count = min(len(r), nbytes * 8 // 10)
+        words = np.asarray(r.raw_channel(channel)[:count], dtype=np.uint16)
+        bits = (words[:, None] >> np.arange(10, dtype=np.uint16)) & 1
+        stream = np.packbits(bits.astype(np.uint8).ravel(), bitorder='little')
+    else:
+        stream = r._data[:nbytes]
+    return find_alignment(stream)
+
+
+if __name__ == "__main__":
+    import doctest
+    results = doctest.testmod()
+    assert results.failed == 0
+    assert results.attempted > 0
@@ -0,0 +1,570 @@
+# vim:set ts=4 sw=4 sts=4 expandtab:
+"""
+TMDS Decoder
+
+Bulk decoding of aligned 10 bit TMDS symbols held in NumPy arrays. Symbols use
+the same bit ordering as `bits()` / `bint()` in bit_utils.py (and `bits_all`
+in tmds.h).
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+import tmds_tokens
+from tmds_analysis import nearest_mask
+from tmds_align import find_control_pairs, NO_ALIGNMENT
+
+
+# Token types, the same values as enum tmds_token_type in tmds.h
+TMDS_ERROR = 0
+TMDS_PIXEL_10b8b = 1
+TMDS_CTRL_10b2b = 2
+# FIXME: tmds_tokens doesn't know about TERC4 tokens yet, so nothing decodes
+# to this type.
+TMDS_AUX_10b4b = 3
+
+# Marks a symbol which doesn't decode to pixel data.
+PIXEL_ERROR = 0x100
+
+
+_token_table = None
+
+def token_table():
+    """Return a 1024 entry table mapping a symbol to `value | (type << 8)`.
+
+    This is the Python version of tmds_encoded_to_token (see tmds_c.py). The
+    value is the pixel byte for pixel tokens and `c0 | (c1 << 1)` for control
+    tokens.
+
+    >>> t = token_table()
+    >>> int(t[0b0111110000]) == 0x10 | (TMDS_PIXEL_10b8b << 8)
+    True
+    >>> int(t[0b0101010100]) == 0b10 | (TMDS_CTRL_10b2b << 8)
+    True
+    >>> int(t[0b0000001010]) == TMDS_ERROR << 8
+    True
+    """
+    global _token_table
+    if _token_table is None:
+        table = np.zeros(2**10, dtype='<u2')
+        for data in range(256):
+            for token in tmds_tokens.DataToken.mapping(data):
+                table[int(token)] = data | (TMDS_PIXEL_10b8b << 8)
+        for token in tmds_tokens.ControlToken.tokens():
+            table[int(token)] = (token.c0 | (token.c1 << 1)) | (TMDS_CTRL_10b2b << 8)
+        _token_table = table
+    return _token_table
+
+
+DecodedSymbols = namedtuple("DecodedSymbols", ["type", "pixel", "c0", "c1"])
+
+
+def decode(symbols):
+    """Decode an array of aligned symbols.
+
+    Returns DecodedSymbols of uint8 arrays, each the same shape as symbols;
+     * type  - One of the TMDS_* token types.
+     * pixel - The pixel value (0 for non-pixel tokens).
+     * c0/c1 - The control values (0 for non-control tokens).
+
+    >>> d = decode([0b0111110000, 0b0101010100, 0b0000001010, 0b1010101011])
+    >>> d.type.tolist() == [TMDS_PIXEL_10b8b, TMDS_CTRL_10b2b, TMDS_ERROR, TMDS_CTRL_10b2b]
+    True
+    >>> d.pixel.tolist(), d.c0.tolist(), d.c1.tolist()
+    ([16, 0, 0, 0], [0, 0, 0, 1], [0, 1, 0, 1])
+    """
+    symbols = np.asarray(symbols, dtype=np.uint16)
+    entries = token_table()[symbols & 0x3ff]
+    value = (entries & 0xff).astype(np.uint8)
+    token_type = (entries >> 8).astype(np.uint8)
+
+    is_pixel = token_type == TMDS_PIXEL_10b8b
+    is_ctrl = (token_type == TMDS_CTRL_10b2b).view(np.uint8)
+    return DecodedSymbols(
+        token_type,
+        np.where(is_pixel, value, np.uint8(0)),
+        value & is_ctrl,
+        (value >> 1) & is_ctrl,
+        )
+
+
+_decode_table = None
+
+def decode_table():
+    """Return a 1024 entry table mapping a symbol to its pixel value.
+
+    Symbols which are not pixel data map to PIXEL_ERROR.
+
+    >>> t = decode_table()
+    >>> int(t[0b0111110000]), int(t[0b1111111111]), int(t[0b1101010100]) == PIXEL_ERROR
+    (16, 0, True)
+    """
+    global _decode_table
+    if _decode_table is None:
+        tokens = token_table()
+        _decode_table = np.where(
+            (tokens >> 8) == TMDS_PIXEL_10b8b, tokens & 0xff, PIXEL_ERROR).astype(np.uint16)
+    return _decode_table
+
+
+_wide_decode_table = None
+
+def wide_decode_table():
+    """Return the two symbol version of decode_table.
+
+    Indexed by `symbol0 | (symbol1 << 10)`, each entry is
+    `value0 | (value1 << 16)` so that viewing a run of entries as little
+    endian 16 bit words gives the values in order.
+
+    Built (once) on first use.
+
+    >>> t = wide_decode_table()
+    >>> e = int(t[0b0111110000 | (0b1111111111 << 10)])
+    >>> e & 0xffff, e >> 16
+    (16, 0)
+    """
+    global _wide_decode_table
+    if _wide_decode_table is None:
+        single = decode_table().astype('<u4')
+        index = np.arange(2**20, dtype=np.uint32)
+        _wide_decode_table = single[index & 0x3ff] | (single[index >> 10] << 16)
+    return _wide_decode_table
+
+
+def decode_pixels(symbols, wide=False):
+    """Decode an array of aligned symbols to pixel values.
+
+    Returns a uint16 array the same shape as symbols, holding the pixel byte
+    or PIXEL_ERROR. With wide=True pairs of symbols are decoded per lookup
+    using wide_decode_table.
+
+    >>> s = np.array([0b0111110000, 0b1111111111, 0b1101010100], dtype=np.uint16)
+    >>> decode_pixels(s).tolist() == [0x10, 0x00, PIXEL_ERROR]
+    True
+    >>> assert decode_pixels(s, wide=True).tolist() == decode_pixels(s).tolist()
+    """
+    symbols = np.asarray(symbols, dtype=np.uint16)
+    if not wide:
+        return decode_table()[symbols & 0x3ff]
+
+    flat = symbols.ravel() & 0x3ff
+    paired = len(flat) & ~1
+    index = flat[0:paired:2].astype(np.uint32) | (flat[1:paired:2].astype(np.uint32) << 10)
+    out = np.empty(len(flat), dtype=np.uint16)
+    out[:paired] = wide_decode_table()[index].view('<u2')
+    out[paired:] = decode_table()[flat[paired:]]
+    return out.reshape(symbols.shape)
+
+
+NearestIndex = namedtuple("NearestIndex", ["distance", "count", "offset", "symbols"])
+
+
+def valid_symbols():
+    """Return the valid (data and control) symbols, in order, as a uint16 array.
+
+    >>> len(valid_symbols())
+    464
+    """
+    return np.flatnonzero((token_table() >> 8) != TMDS_ERROR).astype(np.uint16)
+
+
+def build_nearest_index():
+    valid = valid_symbols()
+    distance, nearest = nearest_mask(np.arange(2**10), valid)
+    count = nearest.sum(axis=1)
+    offset = np.concatenate(([0], np.cumsum(count)[:-1]))
+    # Row major, so the symbols for each code are together and in order
+    symbols = np.broadcast_to(valid, nearest.shape)[nearest]
+    return NearestIndex(
+        distance.astype(np.uint8), count.astype(np.uint16), offset.astype(np.uint32), symbols)
+
+
+_nearest_index = None
+
+def nearest_index():
+    """Return the nearest valid symbols (by Hamming distance) for every code.
+
+    NearestIndex(distance, count, offset, symbols) where for a code c;
+     * distance[c] - The distance to the nearest valid symbol (0 if c is
+                     valid).
+     * count[c]    - How many valid symbols are at that distance.
+     * symbols[offset[c]:offset[c] + count[c]] - Those symbols.
+
+    >>> n = nearest_index()
+    >>> int(n.distance[0b0111110000]), int(n.count[0b0111110000])
+    (0, 1)
+    >>> nearest_symbols(0b0000001010)
+    [2, 8, 11, 14]
+    >>> int(n.distance[0b0000001010])
+    1
+
+    Of the 560 forbidden codes, 60 have a single valid symbol one bit away
+    and 48 are more than one bit away from any.
+    >>> np.bincount(correction_table() >> 10).tolist()
+    [464, 60, 452, 48]
+    """
+    global _nearest_index
+    if _nearest_index is None:
+        _nearest_index = build_nearest_index()
+    return _nearest_index
+
+
+def nearest_symbols(code):
+    """Return the list of valid symbols nearest to a code."""
+    n = nearest_index()
+    start = int(n.offset[code])
+    return n.symbols[start:start + int(n.count[code])].tolist()
+
+
+# Status of a symbol after correction
+SYMBOL_VALID = 0
+SYMBOL_CORRECTED = 1
+# Forbidden, but with more than one valid symbol a single bit away
+SYMBOL_AMBIGUOUS = 2
+# Forbidden and more than a single bit away from any valid symbol
+SYMBOL_UNCORRECTABLE = 3
+
+
+_correction_table = None
+
+def correction_table():
+    """Return a 1024 entry table mapping a code to `symbol | (status << 10)`.
+
+    Forbidden codes with a single valid symbol one bit away map to that
+    symbol (SYMBOL_CORRECTED), every other code maps to itself.
+
+    >>> t = correction_table()
+    >>> int(t[0b0111110000]) == 0b0111110000 | (SYMBOL_VALID << 10)
+    True
+    >>> int(t[0b0000001010] >> 10) == SYMBOL_AMBIGUOUS
+    True
+    """
+    global _correction_table
+    if _correction_table is None:
+        n = nearest_index()
+        codes = np.arange(2**10, dtype=np.uint16)
+        status = np.select(
+            [n.distance == 0, (n.distance == 1) & (n.count == 1), n.distance == 1],
+            [SYMBOL_VALID, SYMBOL_CORRECTED, SYMBOL_AMBIGUOUS],
+            SYMBOL_UNCORRECTABLE).astype(np.uint16)
+        first = n.symbols[np.minimum(n.offset, len(n.symbols) - 1)]
+        symbol = np.where(status == SYMBOL_CORRECTED, first, codes)
+        _correction_table = (symbol | (status << 10)).astype(np.uint16)
+    return _correction_table
+
+
+CorrectedSymbols = namedtuple("CorrectedSymbols", ["symbols", "status"])
+
+
+def correct(symbols):
+    """Correct single bit errors in an array of aligned symbols.
+
+    Returns CorrectedSymbols(symbols, status), status holding one of the
+    SYMBOL_* values for each symbol.
+
+    >>> s = 0b0000000110
+    >>> c = correct([s, s ^ 0b0000010000, 0b0000001010])
+    >>> c.symbols.tolist() == [s, s, 0b0000001010]
+    True
+    >>> c.status.tolist() == [SYMBOL_VALID, SYMBOL_CORRECTED, SYMBOL_AMBIGUOUS]
+    True
+    """
+    entries = correction_table()[np.asarray(symbols, dtype=np.uint16) & 0x3ff]
+    return CorrectedSymbols(entries & 0x3ff, (entries >> 10).astype(np.uint8))
+
+
+def decode_corrected(symbols):
+    """Same as decode, after correcting single bit errors.
+
+    Returns (DecodedSymbols, status), see correct().
+
+    >>> d, status = decode_corrected([0b0000000110, 0b0000010110])
+    >>> d.pixel.tolist(), status.tolist() == [SYMBOL_VALID, SYMBOL_CORRECTED]
+    ([244, 244], True)
+    """
+    corrected = correct(symbols)
+    return decode(corrected.symbols), corrected.status
+
+
+SymbolRuns = namedtuple("SymbolRuns", ["symbol", "start", "length"])
+
+
+def symbol_runs(symbols):
+    """Find the runs of identical symbols in an array of aligned symbols.
+
+    Returns SymbolRuns of arrays, one entry per run, with the symbol, the
+    index of its first position and the number of positions.
+
+    >>> r = symbol_runs([852, 852, 852, 496, 496, 1023, 852])
+    >>> r.symbol.tolist(), r.start.tolist(), r.length.tolist()
+    ([852, 496, 1023, 852], [0, 3, 5, 6], [3, 2, 1, 1])
+    """
+    symbols = np.asarray(symbols, dtype=np.uint16).ravel()
+    change = np.flatnonzero(symbols[1:] != symbols[:-1]) + 1
+    start = np.concatenate(([0], change)) if len(symbols) else change
+    length = np.diff(np.concatenate((start, [len(symbols)])))
+    return SymbolRuns(symbols[start], start, length)
+
+
+ActiveSpan = namedtuple("ActiveSpan", ["start", "pixels"])
+DecodedRuns = namedtuple("DecodedRuns", ["control", "active"])
+
+# In active_table control tokens are CONTROL_KEY | ((c0 | (c1 << 1)) << 9),
+# so or-ing PIXEL_MASK into an entry makes every pixel value (and
+# PIXEL_ERROR) the same while keeping the control tokens apart.
+CONTROL_KEY = 0x800
+PIXEL_MASK = 0x1ff
+
+_active_table = None
+
+def active_table():
+    """Return decode_table with the control tokens marked (see CONTROL_KEY).
+
+    >>> t = active_table()
+    >>> int(t[0b0111110000]), int(t[0b1010101011]) == CONTROL_KEY | (3 << 9), int(t[0b0000001010]) == PIXEL_ERROR
+    (16, True, True)
+    """
+    global _active_table
+    if _active_table is None:
+        tokens = token_table()
+        _active_table = np.where(
+            (tokens >> 8) == TMDS_CTRL_10b2b, CONTROL_KEY | ((tokens & 0x3) << 9),
+            decode_table()).astype(np.uint16)
+    return _active_table
+
+
+def decode_active(symbols):
+    """Decode an array of aligned symbols, skipping through blanking.
+
+    Returns DecodedRuns(control, active);
+     * control - SymbolRuns of the runs of control tokens.
+     * active  - A list of ActiveSpan(start, pixels) for each stretch
+                 between them, pixels as from decode_pixels (so forbidden
+                 symbols are PIXEL_ERROR).
+
+    Blanking comes back as one entry per run rather than per symbol. Every
+    symbol is decoded with a single lookup in active_table, and the
+    active pixels are views of that rather than copies.
+
+    >>> ctrl0, ctrl1 = 852, 171
+    >>> d = decode_active([ctrl0] * 100 + [496, 496, 1023] + [ctrl1] * 50 + [0b0000001010])
+    >>> d.control.symbol.tolist(), d.control.start.tolist(), d.control.length.tolist()
+    ([852, 171], [0, 103], [100, 50])
+    >>> [(a.start, a.pixels.tolist()) for a in d.active] == [(100, [0x10, 0x10, 0x00]), (153, [PIXEL_ERROR])]
+    True
+    """
+    symbols = np.asarray(symbols, dtype=np.uint16).ravel()
+    decoded = np.take(active_table(), symbols & 0x3ff)
+
+    # Only control tokens and the edges of active video start new runs
+    runs = symbol_runs(decoded | np.uint16(PIXEL_MASK))
+    ctrl_runs = runs.symbol >= CONTROL_KEY
+    control = SymbolRuns(
+        symbols[runs.start[ctrl_runs]], runs.start[ctrl_runs], runs.length[ctrl_runs])
+
+    active = []
+    for start, length in zip(runs.start[~ctrl_runs].tolist(), runs.length[~ctrl_runs].tolist()):
+        active.append(ActiveSpan(start, decoded[start:start + length]))
+    return DecodedRuns(control, active)
+
+
+def bits_to_symbols(bits):
+    """Turn an array of bits (LSB first) into an array of 10 bit symbols.
+
+    >>> bits_to_symbols(np.array([0,0,1,0,1,0,1,0,1,1, 1,0,0,0,0,0,0,0,0,0], dtype=np.uint8)).tolist()
+    [852, 1]
+    """
+    n = len(bits) // 10
+    b = np.asarray(bits[:n * 10], dtype=np.uint16).reshape(n, 10)
+    return (b << np.arange(10, dtype=np.uint16)).sum(axis=1, dtype=np.uint16)
+
+
+SymbolBlock = namedtuple("SymbolBlock", ["offset", "symbols"])
+
+
+class LockTracker:
+    """Streaming decoder which finds and keeps the symbol alignment.
+
+    While SEARCHING the phase is acquired from a run of `acquire` control
+    token pairs at the same phase. Once LOCKED symbols are decoded at that
+    phase, and lock is only dropped (going back to SEARCHING) after
+    `max_errors` forbidden symbols without a blanking period in between, or,
+    if `line_length` (in symbols) is given, when `max_missed_blanking` lines
+    go by without any control tokens.
+
+    feed() takes chunks of the packed LSB first bit stream and returns a list
+    of SymbolBlock(offset, symbols), where offset is the bit offset in the
+    stream of the first aligned symbol.
+
+    >>> import tmds_encoder
+    >>> ctrl = tmds_encoder.encode_control(0, 0)
+    >>> pixels = list(tmds_encoder.TMDSEncoder().encode(bytes(range(40))))
+    >>> forbidden = 0b0000001010
+    >>> def pack(symbols, skip=0):
+    ...     v = sum(s << (skip + 10 * i) for i, s in enumerate(symbols))
+    ...     return v.to_bytes((skip + 10 * len(symbols)) // 8, "little")
+    >>> stream = pack([ctrl] * 10 + pixels + [ctrl] * 8 + pixels, skip=4)
+
+    >>> t = LockTracker(max_errors=4)
+    >>> blocks = t.feed(stream[:20]) + t.feed(stream[20:])
+    >>> t.state == LockTracker.LOCKED, t.phase
+    (True, 4)
+    >>> blocks[0].offset
+    4
+    >>> symbols = np.concatenate([b.symbols for b in blocks]).tolist()
+    >>> assert symbols == [ctrl] * 10 + pixels + [ctrl] * 8 + pixels
+
+    A few bad symbols don't lose lock, too many do.
+    >>> _ = t.feed(pack([forbidden] * 3 + [ctrl] * 2 + [forbidden] * 3))
+    >>> t.state == LockTracker.LOCKED
+    True
+    >>> _ = t.feed(pack([forbidden] * 4))
+    >>> t.state == LockTracker.SEARCHING, t.unlock_count
+    (True, 1)
+
+    As does going too long without blanking.
+    >>> t = LockTracker(line_length=50, max_missed_blanking=2)
+    >>> _ = t.feed(pack([ctrl] * 8 + pixels * 2))
+    >>> t.state == LockTracker.LOCKED
+    True
+    >>> _ = t.feed(pack(pixels * 2))
+    >>> t.state == LockTracker.SEARCHING
+    True
+
+    But a vertical blanking period longer than that is still blanking.
+    >>> t = LockTracker(line_length=50, max_missed_blanking=2)
+    >>> _ = t.feed(pack([ctrl] * 8 + pixels * 2 + [ctrl] * 152 + pixels * 2 + [ctrl] * 8))
+    >>> t.state == LockTracker.LOCKED, t.lock_count, t.unlock_count
+    (True, 1, 0)
+    """
+
+    SEARCHING = 0
+    LOCKED = 1
+
+    def __init__(self, max_errors=16, max_missed_blanking=2, line_length=None, acquire=4):
+        self.max_errors = max_errors
+        self.max_missed_blanking = max_missed_blanking
+        self.line_length = line_length
+        self.acquire = acquire
+
+        self.state = self.SEARCHING
+        self.phase = NO_ALIGNMENT
+        self.errors = 0
+        self.lock_count = 0
+        self.unlock_count = 0
+
+        # Bits not yet decoded and the stream offset of the first one
+        self._bits = np.zeros(0, dtype=np.uint8)
+        self._offset = 0
+        # Symbols since the last control token
+        self._since_blanking = 0
+
+    def _drop(self, n):
+        self._bits = self._bits[n:]
+        self._offset += n
+
+    def feed(self, data):
+        bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8), bitorder='little')
+        self._bits = np.concatenate([self._bits, bits])
+
+        blocks = []
+        while True:
+            if self.state == self.SEARCHING:
+                if not self._search():
+                    break
+            else:
+                block = self._track()
+                if len(block.symbols):
+                    blocks.append(block)
+                if self.state == self.LOCKED:
+                    break
+        return blocks
+
+    def _search(self):
+        packed = np.packbits(self._bits, bitorder='little')
+        offsets = find_control_pairs(packed)
+        offsets = offsets[offsets + 20 <= len(self._bits)]
+
+        found = set(offsets.tolist())
+        for offset in offsets.tolist():
+            if all(offset + 10 * i in found for i in range(1, self.acquire)):
+                self._drop(offset)
+                self.state = self.LOCKED
+                self.phase = self._offset % 10
+                self.errors = 0
+                self._since_blanking = 0
+                self.lock_count += 1
+                return True
+
+        # Keep enough bits to find a run which crosses into the next chunk
+        keep = 10 * (self.acquire + 1)
+        if len(self._bits) > keep:
+            self._drop(len(self._bits) - keep)
+        return False
+
+    def _track(self):
+        symbols = bits_to_symbols(self._bits)
+        n = len(symbols)
+        types = token_table()[symbols] >> 8
+
+        is_ctrl = types == TMDS_CTRL_10b2b
+        ctrl = np.flatnonzero(is_ctrl)
+        ctrl_end = is_ctrl.copy()
+        ctrl_end[:-1] &= ~is_ctrl[1:]
+        errors = np.nonzero(types == TMDS_ERROR)[0].tolist()
+        ctrl_ends = np.nonzero(ctrl_end)[0].tolist()
+
+        # Index of the last control token, relative to this block
+        last_ctrl = -1 - self._since_blanking
+        if len(ctrl):
+            new_last_ctrl = int(ctrl[-1])
+        else:
+            new_last_ctrl = last_ctrl
+
+        # The deadline is measured from every control token (not the end of
+        # each run), so a long vertical blanking period keeps the lock. Lock
+        # is lost at the first gap between control tokens (or from the last
+        # one to the end of the block) which reaches the deadline.
+        lost_deadline = None
+        if self.line_length:
+            limit = self.line_length * self.max_missed_blanking
+            previous = np.concatenate(([last_ctrl], ctrl))
+            following = np.concatenate((ctrl, [n - 1]))
+            missed = np.flatnonzero(following >= previous + 1 + limit)
+            if len(missed):
+                lost_deadline = int(previous[missed[0]]) + 1 + limit
+
+        # Walk the (sparse) events in order, up to the deadline
+        lost = None
+        events = sorted([(i, 0) for i in errors] + [(i, 1) for i in ctrl_ends])
+        for i, is_blanking in events:
+            if lost_deadline is not None and i >= lost_deadline:
+                break
+            if is_blanking:
+                self.errors = 0
+            else:
+                self.errors += 1
+                if self.errors >= self.max_errors:
+                    lost = i
+                    break
+        if lost is None:
+            lost = lost_deadline
+
+        block = SymbolBlock(self._offset, symbols[:lost])
+        if lost is None:
+            self._since_blanking = n - 1 - new_last_ctrl
+            self._drop(n * 10)
+        else:
+            self._drop(lost * 10)
+            self.state = self.SEARCHING
+            self.phase = NO_ALIGNMENT
+            self.unlock_count += 1
+        return block
+
+
+if __name__ == "__main__":
+    import doctest
+    results = doctest.testmod()
+    assert results.failed == 0
+    assert results.attempted > 0
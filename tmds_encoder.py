@@ -0,0 +1,533 @@
+# vim:set ts=4 sw=4 sts=4 expandtab:
+"""
+TMDS Encoder
+
+Streaming implementation of the "3.2.2 Encode Algorithm" from the DVI 1.0
+specification (see the description in tmds_8b10.py).
+
+Symbols are returned as 10 bit integers using the same bit ordering as
+`bits()` / `bint()` in bit_utils.py, IE bit 0 of the integer is q_out[0] (the
+first bit on the wire) and bit 9 is q_out[9]. This is the same ordering used
+by `bits_all` in tmds.h.
+
+The only state carried between symbols is the running disparity Cnt(t), so an
+encoder can be stopped after any symbol, its state exported and a new encoder
+(in another process even) resumed from that point.
+"""
+
+import array
+import itertools
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+from bit_utils import *
+from bit_arrays import ONES_TABLE
+import tmds_tokens
+
+
+def _q_m(data_int):
+    """Stage 1 - Return (q_m[0:7], q_m[8]) for a byte.
+
+    Worked out from the tokens which tmds_tokens generated for the byte; a
+    token which isn't inverted is q_m, an inverted one is ~q_m.
+
+    >>> _q_m(0x10)
+    (240, 1)
+    >>> _q_m(0xef)
+    (15, 0)
+    """
+    token = next(iter(tmds_tokens.DataToken.mapping(data_int)))
+    q_m = bint(token.w)
+    if token.i:
+        q_m ^= 0xff
+    return q_m, token.x
+
+
+def encode_pixel(data_int, cnt):
+    """Encode a pixel byte given the running disparity Cnt(t-1).
+
+    Returns (symbol, Cnt(t)).
+
+    >>> encode_pixel(0x10, 0)
+    (496, 0)
+    >>> encode_pixel(0x00, 0)
+    (256, -8)
+    >>> encode_pixel(0x00, -8)
+    (1023, 2)
+    >>> encode_pixel(0xff, 2)
+    (512, -6)
+    """
+    q_m, q_m8 = _q_m(data_int)
+    q_out9, cnt = _stage2(ones_int(q_m), q_m8, cnt)
+    if q_out9:
+        q_out = q_m ^ 0xff
+    else:
+        q_out = q_m
+    return q_out | (q_m8 << 8) | (q_out9 << 9), cnt
+
+
+def _stage2(n1, q_m8, cnt):
+    """Stage 2 - Decide if q_m should be inverted.
+
+    Only depends on the number of ones in q_m[0:7], q_m[8] and Cnt(t-1).
+    Returns (q_out[9], Cnt(t)).
+    """
+    n0 = 8 - n1
+
+    if cnt == 0 or n1 == n0:
+        q_out9 = int(not q_m8)
+        if q_m8:
+            cnt += n1 - n0
+        else:
+            cnt += n0 - n1
+    elif (cnt > 0 and n1 > n0) or (cnt < 0 and n0 > n1):
+        q_out9 = 1
+        cnt += 2 * q_m8 + (n0 - n1)
+    else:
+        q_out9 = 0
+        cnt += -2 * int(not q_m8) + (n1 - n0)
+
+    return q_out9, cnt
+
+
+def encode_control(c0, c1):
+    """Return the control symbol for C0/C1.
+
+    >>> encode_control(0, 0) == 0b1101010100
+    True
+    >>> encode_control(1, 1) == 0b1010101011
+    True
+    """
+    return int(tmds_tokens.ControlToken.mapping(c0, c1))
+
+
+# Cnt(t) only ever takes the even values between CNT_MIN and CNT_MAX, so it can
+# be stored as a small state index.
+CNT_MIN = -8
+CNT_MAX = 8
+CNT_STATES = (CNT_MAX - CNT_MIN) // 2 + 1
+
+
+def cnt_to_state(cnt):
+    """
+    >>> cnt_to_state(-8), cnt_to_state(0), cnt_to_state(8)
+    (0, 4, 8)
+    """
+    assert CNT_MIN <= cnt <= CNT_MAX, cnt
+    return (cnt - CNT_MIN) // 2
+
+
+def state_to_cnt(state):
+    """
+    >>> state_to_cnt(0), state_to_cnt(4), state_to_cnt(8)
+    (-8, 0, 8)
+    """
+    return state * 2 + CNT_MIN
+
+
+_transition_table = None
+
+def transition_table():
+    """Return the (byte, Cnt) -> (symbol, next Cnt) table.
+
+    The table is a flat array indexed by `(state << 8) | byte` where state is
+    `cnt_to_state(Cnt(t-1))`. Each entry is `symbol | (next_state << 10)`.
+
+    Built (once) by running encode_pixel for every byte in every state.
+
+    >>> t = transition_table()
+    >>> len(t) == CNT_STATES * 256
+    True
+    >>> e = t[(cnt_to_state(-8) << 8) | 0x00]
+    >>> e & 0x3ff, state_to_cnt(e >> 10)
+    (1023, 2)
+    """
+    global _transition_table
+    if _transition_table is None:
+        table = array.array('H', bytes(2 * CNT_STATES * 256))
+        for state in range(CNT_STATES):
+            for data_int in range(256):
+                symbol, cnt = encode_pixel(data_int, state_to_cnt(state))
+                table[(state << 8) | data_int] = symbol | (cnt_to_state(cnt) << 10)
+        _transition_table = table
+    return _transition_table
+
+
+_wide_transition_table = None
+
+def wide_transition_table():
+    """Return the two pixel version of transition_table.
+
+    Indexed by `(state << 16) | pixel0 | (pixel1 << 8)`, IE two pixels read
+    as a little endian 16 bit word. Each entry is
+    `symbol0 | (symbol1 << 16) | (next_state << 26)` so that viewing a run
+    of entries as little endian 16 bit words gives the symbols in order (once
+    masked with 0x3ff).
+
+    Built (once) on first use from transition_table.
+
+    >>> t = wide_transition_table()
+    >>> len(t) == CNT_STATES * 2**16
+    True
+    >>> e = t[(cnt_to_state(0) << 16) | 0x0000]
+    >>> e & 0x3ff, (e >> 16) & 0x3ff, state_to_cnt(e >> 26)
+    (256, 1023, 2)
+    """
+    global _wide_transition_table
+    if _wide_transition_table is None:
+        single = np.array(transition_table(), dtype=np.uint32).reshape(CNT_STATES, 256)
+        state = np.arange(CNT_STATES, dtype=np.uint32)[:, None, None]
+        pixel0 = np.arange(256)[None, None, :]
+        pixel1 = np.arange(256)[None, :, None]
+
+        first = single[state, pixel0]
+        second = single[first >> 10, pixel1]
+        table = (first & 0x3ff) | ((second & 0x3ff) << 16) | ((second >> 10) << 26)
+
+        _wide_transition_table = array.array('I')
+        _wide_transition_table.frombytes(table.astype(np.uint32).tobytes())
+    return _wide_transition_table
+
+
+_POPCOUNT8 = ONES_TABLE[:256]
+
+
+def stage1(data):
+    """Vectorized Stage 1 for an array of pixel bytes (of any shape).
+
+    Returns (q_m[0:7], q_m[8], N1{q_m[0:7]}) as uint8 arrays of the same
+    shape as data.
+
+    For XOR q_m[n] is the parity of D[0:n], which is a prefix XOR of the
+    byte. XNOR is the same with every odd bit flipped.
+
+    >>> q_m, q_m8, n1 = stage1([0x10, 0xef])
+    >>> q_m.tolist(), q_m8.tolist(), n1.tolist()
+    ([240, 15], [1, 0], [4, 4])
+    >>> q_m, q_m8, n1 = stage1(np.arange(256, dtype=np.uint8).reshape(16, 16))
+    >>> q_m.shape
+    (16, 16)
+    >>> assert [(int(a), int(b)) for a, b in zip(q_m.flat, q_m8.flat)] == [_q_m(i) for i in range(256)]
+    """
+    d = np.asarray(data, dtype=np.uint8)
+    n1_d = _POPCOUNT8[d]
+    xnor = (n1_d > 4) | ((n1_d == 4) & ((d & 1) == 0))
+
+    q_m = d ^ (d << 1)
+    q_m ^= q_m << 2
+    q_m ^= q_m << 4
+    q_m ^= np.where(xnor, np.uint8(0xaa), np.uint8(0))
+    q_m8 = (~xnor).view(np.uint8)
+    return q_m, q_m8, _POPCOUNT8[q_m]
+
+
+_stage2_table = None
+
+def stage2_table():
+    """Return the Stage 2 table.
+
+    Indexed by `(state << 5) | (N1{q_m[0:7]} << 1) | q_m[8]`, each entry is
+    `q_out[9] | (next_state << 1)`.
+    """
+    global _stage2_table
+    if _stage2_table is None:
+        table = array.array('B', bytes(CNT_STATES << 5))
+        for state in range(CNT_STATES):
+            for n1 in range(9):
+                for q_m8 in (0, 1):
+                    q_out9, cnt = _stage2(n1, q_m8, state_to_cnt(state))
+                    table[(state << 5) | (n1 << 1) | q_m8] = q_out9 | (cnt_to_state(cnt) << 1)
+        _stage2_table = table
+    return _stage2_table
+
+
+_RunCycleBase = namedtuple("RunCycle", ["symbols", "states", "start"])
+class RunCycle(_RunCycleBase):
+    """The symbols for a run of the same byte from a given state.
+
+    The next state only depends on the current one, so a run of one byte
+    goes through at most CNT_STATES states before repeating. symbols holds
+    the symbols up to the first repeat, states the state before each of
+    them and everything from start onwards repeats.
+
+    >>> r = run_cycle(0x10, cnt_to_state(2))
+    >>> r.symbols.tolist(), r.start, r.period
+    ([496], 0, 1)
+    >>> r = run_cycle(0x00, cnt_to_state(0))
+    >>> [state_to_cnt(s) for s in r.states], r.start
+    ([0, -8, 2, -6, 4, -4, 6, -2, 8], 0)
+    >>> r.run(11).tolist()
+    [256, 1023, 256, 1023, 256, 1023, 256, 1023, 256, 256, 1023]
+    >>> state_to_cnt(r.state_after(7)), state_to_cnt(r.state_after(11))
+    (-2, 2)
+    """
+
+    @property
+    def period(self):
+        return len(self.symbols) - self.start
+
+    def run(self, n):
+        """Return the first n symbols of the run."""
+        if n <= len(self.symbols):
+            return self.symbols[:n]
+        m = n - len(self.symbols)
+        repeats = np.tile(self.symbols[self.start:], -(-m // self.period))[:m]
+        return np.concatenate((self.symbols, repeats))
+
+    def state_after(self, n):
+        """Return the state after n symbols of the run."""
+        if n < len(self.states):
+            return self.states[n]
+        return self.states[self.start + (n - self.start) % self.period]
+
+
+_run_cycles = {}
+
+def run_cycle(data_int, state):
+    """Return the (cached) RunCycle for a byte starting from a state."""
+    key = (data_int, state)
+    cycle = _run_cycles.get(key)
+    if cycle is None:
+        table = transition_table()
+        seen = {}
+        symbols = []
+        while state not in seen:
+            seen[state] = len(symbols)
+            entry = table[(state << 8) | data_int]
+            symbols.append(entry & 0x3ff)
+            state = entry >> 10
+        cycle = RunCycle(
+            np.array(symbols, dtype=np.uint16), list(seen), seen[state])
+        _run_cycles[key] = cycle
+    return cycle
+
+
+_EncoderStateBase = namedtuple("EncoderState", ["cnt", "position"])
+class EncoderState(_EncoderStateBase):
+    """State needed to resume a TMDSEncoder.
+
+    cnt      - The running disparity, Cnt(t).
+    position - Number of symbols produced so far.
+
+    >>> EncoderState()
+    EncoderState(cnt=0, position=0)
+    """
+
+    def __new__(cls, cnt=0, position=0):
+        assert cnt % 2 == 0, cnt
+        return _EncoderStateBase.__new__(cls, cnt, position)
+
+
+def _per_symbol(v):
+    """Turn a scalar into something which can be iterated forever."""
+    try:
+        return iter(v)
+    except TypeError:
+        return itertools.repeat(v)
+
+
+class TMDSEncoder:
+    """Stateful TMDS encoder for one channel.
+
+    >>> e = TMDSEncoder()
+    >>> list(e.encode(b"\\x00\\x00\\x10"))
+    [256, 1023, 496]
+    >>> e.state
+    EncoderState(cnt=2, position=3)
+
+    Blanking outputs control tokens and resets the running disparity.
+    >>> list(e.encode(b"\\x00\\x00", de=0, c0=[0, 1], c1=1))
+    [340, 683]
+    >>> list(e.encode(b"\\x00\\x00\\x00", de=[1, 0, 1]))
+    [256, 852, 256]
+
+    Splitting a stream at any point gives the same result.
+    >>> data = bytes(range(0, 256, 3))
+    >>> whole = list(TMDSEncoder().encode(data))
+    >>> e1 = TMDSEncoder()
+    >>> first = list(e1.encode(data[:41]))
+    >>> e2 = TMDSEncoder(e1.state)
+    >>> assert first + list(e2.encode(data[41:])) == whole
+
+    Pixels can also be a uint8 NumPy array.
+    >>> assert list(TMDSEncoder().encode(np.frombuffer(data, np.uint8))) == whole
+
+    Whole lines can be encoded into an array in one go.
+    >>> e3 = TMDSEncoder()
+    >>> assert list(e3.encode_line(data)) == whole
+    >>> assert e3.state == TMDSEncoder(e2.state).state
+    >>> assert list(TMDSEncoder().encode_line(np.frombuffer(data, np.uint8))) == whole
+
+    Optionally two pixels at a time.
+    >>> e5 = TMDSEncoder()
+    >>> assert list(e5.encode_line(data, wide=True)) == whole
+    >>> assert e5.state == e3.state
+
+    Or as a NumPy array, with only Stage 2 done one pixel at a time.
+    >>> e4 = TMDSEncoder()
+    >>> assert e4.encode_array(np.frombuffer(data, np.uint8)).tolist() == whole
+    >>> assert e4.state == e3.state
+
+    Runs of the same byte can be skipped through.
+    >>> fill = np.repeat(np.frombuffer(data, np.uint8)[:20], np.arange(20) * 5)
+    >>> e6, e7 = TMDSEncoder(EncoderState(cnt=4)), TMDSEncoder(EncoderState(cnt=4))
+    >>> assert (e6.encode_runs(fill) == e7.encode_array(fill)).all()
+    >>> assert e6.state == e7.state
+    """
+
+    def __init__(self, state=None):
+        if state is None:
+            state = EncoderState()
+        self.state = state
+
+    @property
+    def state(self):
+        return EncoderState(self.cnt, self.position)
+
+    @state.setter
+    def state(self, state):
+        cnt, self.position = EncoderState(*state)
+        self._state = cnt_to_state(cnt)
+
+    @property
+    def cnt(self):
+        return state_to_cnt(self._state)
+
+    def reset(self):
+        self.state = EncoderState()
+
+    def encode(self, pixels, de=1, c0=0, c1=0):
+        """Encode a chunk of pixel bytes, yielding 10 bit symbols.
+
+        de, c0 and c1 can either be a single value for the whole chunk or an
+        iterable with a value per pixel. When de is low the pixel value is
+        ignored and the control token for c0/c1 is output instead.
+
+        The encoder state is updated as each symbol is yielded.
+        """
+        if isinstance(pixels, np.ndarray):
+            pixels = pixels.tolist()
+        table = transition_table()
+        blank_state = cnt_to_state(0)
+        for data, de_t, c0_t, c1_t in zip(
+                pixels, _per_symbol(de), _per_symbol(c0), _per_symbol(c1)):
+            if de_t:
+                entry = table[(self._state << 8) | data]
+                symbol = entry & 0x3ff
+                self._state = entry >> 10
+            else:
+                symbol = encode_control(c0_t, c1_t)
+                self._state = blank_state
+            self.position += 1
+            yield symbol
+
+    def encode_line(self, pixels, wide=False):
+        """Encode a run of active video (DE high) pixel bytes.
+
+        Returns an array of 16 bit symbols. The state is only updated at the
+        end of the run.
+
+        With wide=True two pixels are encoded per lookup using
+        wide_transition_table.
+        """
+        if wide:
+            return self._encode_line_wide(pixels)
+
+        if isinstance(pixels, np.ndarray):
+            pixels = pixels.tolist()
+        table = transition_table()
+        state = self._state
+        out = array.array('H', bytes(2 * len(pixels)))
+        for i, data in enumerate(pixels):
+            entry = table[(state << 8) | data]
+            out[i] = entry & 0x3ff
+            state = entry >> 10
+        self._state = state
+        self.position += len(out)
+        return out
+
+    def _encode_line_wide(self, pixels):
+        pixels = bytes(pixels)
+        pairs = array.array('H')
+        pairs.frombytes(pixels[:len(pixels) & ~1])
+        if sys.byteorder != "little":
+            pairs.byteswap()
+
+        table = wide_transition_table()
+        state = self._state
+        entries = array.array('I', bytes(4 * len(pairs)))
+        for i, pair in enumerate(pairs):
+            entry = table[(state << 16) | pair]
+            entries[i] = entry
+            state = entry >> 26
+        self._state = state
+        self.position += 2 * len(pairs)
+
+        symbols = np.frombuffer(entries, dtype=np.uint32).astype('<u4').view('<u2') & 0x3ff
+        out = array.array('H', symbols.astype(np.uint16).tobytes())
+        if len(pixels) & 1:
+            out.extend(self.encode_line(pixels[-1:]))
+        return out
+
+    def encode_array(self, pixels):
+        """Encode an array of active video (DE high) pixel bytes.
+
+        pixels can be any shape and is encoded in C order as one stream.
+        Returns a uint16 array of symbols with the same shape.
+        """
+        q_m, q_m8, n1 = stage1(pixels)
+        classes = ((n1 << 1) | q_m8).ravel().tolist()
+
+        table = stage2_table()
+        state = self._state
+        q_out9 = bytearray(len(classes))
+        for i, c in enumerate(classes):
+            entry = table[(state << 5) | c]
+            q_out9[i] = entry & 1
+            state = entry >> 1
+        self._state = state
+        self.position += len(classes)
+
+        q_out9 = np.frombuffer(q_out9, dtype=np.uint8).reshape(q_m.shape)
+        symbols = (q_m ^ (q_out9 * np.uint8(0xff))).astype(np.uint16)
+        symbols |= q_m8.astype(np.uint16) << 8
+        symbols |= q_out9.astype(np.uint16) << 9
+        return symbols
+
+    def encode_runs(self, pixels, min_run=16):
+        """Same as encode_array, but runs of at least min_run of the same
+        byte are filled in from their RunCycle rather than encoded a pixel
+        at a time.
+        """
+        pixels = np.asarray(pixels, dtype=np.uint8)
+        data = pixels.ravel()
+        out = np.empty(len(data), dtype=np.uint16)
+
+        change = np.flatnonzero(data[1:] != data[:-1]) + 1
+        starts = np.concatenate(([0], change))
+        ends = np.concatenate((change, [len(data)]))
+        long_runs = (ends - starts) >= min_run
+        if not long_runs.any():
+            return self.encode_array(pixels)
+
+        done = 0
+        for start, end in zip(starts[long_runs].tolist(), ends[long_runs].tolist()):
+            if start > done:
+                out[done:start] = self.encode_array(data[done:start])
+            cycle = run_cycle(int(data[start]), self._state)
+            out[start:end] = cycle.run(end - start)
+            self._state = cycle.state_after(end - start)
+            self.position += end - start
+            done = end
+        if done < len(data):
+            out[done:] = self.encode_array(data[done:])
+        return out.reshape(pixels.shape)
+
+
+if __name__ == "__main__":
+    import doctest
+    results = doctest.testmod()
+    assert results.failed == 0
+    assert results.attempted > 0
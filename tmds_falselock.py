@@ -0,0 +1,245 @@
+# vim:set ts=4 sw=4 sts=4 expandtab:
+"""
+TMDS False Lock
+
+tmds_align.py (and the LockTracker in tmds_decoder.py) find the symbol
+boundaries by looking for two control tokens back to back. This checks if a
+stream of valid symbols, looked at with the wrong alignment, can ever look
+like a control token pair.
+
+A 20 bit window starting `phase` bits into symbol a covers the top
+10 - phase bits of a, all of b and the bottom phase bits of c, so every
+window is covered by searching all triples of valid symbols (a, b, c) at
+all 10 phases. For each window the Hamming distance to the nearest control
+token pair is found; a distance of 0 at a phase other than 0 would be a
+false lock, a distance of n needs n bit errors.
+
+Probabilities are for active video with uniformly random pixel bytes,
+using the stationary distribution of the encoder's running disparity (so
+they are exact for a long run of random pixels, not an approximation of the
+Cnt state).
+"""
+
+from collections import namedtuple
+from multiprocessing import Pool
+
+import numpy as np
+
+from bit_arrays import ONES_TABLE
+from tmds_align import WINDOW_BITS, _control_symbols
+from tmds_decoder import valid_symbols
+from tmds_encoder import transition_table, CNT_STATES
+
+
+SYMBOL_BITS = 10
+PHASES = 10
+
+
+_pair_distance_table = None
+
+def pair_distance_table():
+    """Return the distance from each 20 bit window to the nearest control
+    token pair (as a 2**20 entry uint8 array).
+
+    >>> ctrl = _control_symbols()
+    >>> t = pair_distance_table()
+    >>> int(t[ctrl[0] | (ctrl[3] << 10)]), int(t[(ctrl[0] | (ctrl[3] << 10)) ^ 0b101])
+    (0, 2)
+    """
+    global _pair_distance_table
+    if _pair_distance_table is None:
+        ctrl = _control_symbols()
+        windows = np.arange(2**WINDOW_BITS, dtype=np.uint32)
+        table = np.full(2**WINDOW_BITS, WINDOW_BITS, dtype=np.uint8)
+        for first in ctrl:
+            for second in ctrl:
+                diff = windows ^ np.uint32(first | (second << SYMBOL_BITS))
+                distance = ONES_TABLE[diff & 0x3ff] + ONES_TABLE[diff >> SYMBOL_BITS]
+                np.minimum(table, distance, out=table)
+        _pair_distance_table = table
+    return _pair_distance_table
+
+
+_SymbolModelBase = namedtuple("SymbolModel", ["stationary", "matrices"])
+class SymbolModel(_SymbolModelBase):
+    """The encoder as a Markov chain, for uniformly random pixel bytes.
+
+    stationary - The stationary distribution over the Cnt states.
+    matrices   - (1024, CNT_STATES, CNT_STATES) array, matrices[s][i, j] is
+                 the probability of sending symbol s and going to state j
+                 from state i. Control and forbidden symbols are all 0.
+
+    The probability of a sequence of symbols is
+    `stationary @ matrices[s0] @ matrices[s1] ... @ ones`.
+
+    >>> m = symbol_model()
+    >>> round(float(m.stationary.sum()), 9), round(float(m.matrices.sum(axis=(0, 2)).min()), 9)
+    (1.0, 1.0)
+    >>> p = m.sequence_probability
+    >>> round(sum(p([s]) for s in valid_symbols().tolist()), 9)
+    1.0
+    """
+
+    def sequence_probability(self, symbols):
+        v = self.stationary
+        for s in symbols:
+            v = v @ self.matrices[s]
+        return float(v.sum())
+
+
+_symbol_model = None
+
+def symbol_model():
+    global _symbol_model
+    if _symbol_model is None:
+        table = transition_table()
+        matrices = np.zeros((2**SYMBOL_BITS, CNT_STATES, CNT_STATES))
+        for state in range(CNT_STATES):
+            for data in range(256):
+                entry = table[(state << 8) | data]
+                matrices[entry & 0x3ff, state, entry >> 10] += 1 / 256
+
+        transition = matrices.sum(axis=0)
+        values, vectors = np.linalg.eig(transition.T)
+        stationary = np.real(vectors[:, np.argmin(abs(values - 1))])
+        stationary /= stationary.sum()
+        _symbol_model = SymbolModel(stationary, matrices)
+    return _symbol_model
+
+
+ALIAS_DTYPE = np.dtype([
+    ("phase", "u1"),
+    ("a", "<u2"),
+    ("b", "<u2"),
+    ("c", "<u2"),
+    ("distance", "u1"),
+    ("probability", "<f8"),
+    ])
+
+
+def _search(task):
+    """Search the windows at one phase for a block of `a` symbols.
+
+    Returns (aliases, histogram), aliases being the ALIAS_DTYPE entries
+    within max_errors and histogram the probability of each distance.
+    """
+    phase, a, max_errors = task
+    a = np.asarray(a, dtype=np.uint32)
+    symbols = valid_symbols()
+    model = symbol_model()
+    table = pair_distance_table()
+
+    # Only the bottom `phase` bits of c are in the window
+    c_low = np.arange(2**phase, dtype=np.uint32)
+    b = symbols.astype(np.uint32)
+    windows = ((a[:, None, None] >> phase)
+               | (b[None, :, None] << (SYMBOL_BITS - phase))
+               | (c_low[None, None, :] << (2 * SYMBOL_BITS - phase)))
+    distance = table[windows]
+
+    # P(a, b, c_low) = stationary @ M[a] @ M[b] @ (sum of M[c] for c_low) @ 1
+    ends = np.zeros((2**phase, CNT_STATES))
+    np.add.at(ends, symbols & (2**phase - 1), model.matrices[symbols].sum(axis=2))
+    va = model.stationary @ model.matrices[a]
+    vab = np.einsum("as,bst->abt", va, model.matrices[symbols])
+    probability = vab @ ends.T
+
+    histogram = np.bincount(
+        distance.ravel(), weights=probability.ravel(), minlength=WINDOW_BITS + 1)
+
+    aliases = []
+    for ia, ib, ic in zip(*np.nonzero(distance <= max_errors)):
+        for c in symbols[(symbols & (2**phase - 1)) == c_low[ic]].tolist():
+            p = float(vab[ia, ib] @ model.matrices[c].sum(axis=1))
+            aliases.append((phase, int(a[ia]), int(b[ib]), c, int(distance[ia, ib, ic]), p))
+    return np.array(aliases, dtype=ALIAS_DTYPE), histogram
+
+
+FalseLocks = namedtuple("FalseLocks", ["aliases", "distance_probability"])
+
+
+def search(max_errors=0, phases=range(PHASES), processes=None, block_size=16):
+    """Search every window of every triple of valid symbols.
+
+    Returns FalseLocks(aliases, distance_probability);
+     * aliases - ALIAS_DTYPE array of the (phase, a, b, c) windows which are
+                 within max_errors bits of a control token pair, sorted by
+                 distance, with the probability of the a, b, c sequence in
+                 random active video.
+     * distance_probability - (PHASES, 21) array, the probability that the
+                 window at a phase is that many bits from a control token
+                 pair in random active video.
+
+    The search is split into blocks of `a` symbols for each phase and run
+    on a pool of processes (or in this process if processes is 0).
+
+    No misaligned window of valid symbols is a control token pair;
+    >>> f = search(max_errors=0, phases=range(4), processes=0)
+    >>> sorted(set(f.aliases["phase"].tolist()))
+    [0]
+    >>> len(f.aliases) == 16 * len(valid_symbols())
+    True
+
+    but single bit errors can make one.
+    >>> f = search(max_errors=1, phases=[3], processes=0)
+    >>> assert len(f.aliases) and (f.aliases["distance"] == 1).all()
+    >>> a = f.aliases[0]
+    >>> p = symbol_model().sequence_probability([a["a"], a["b"], a["c"]])
+    >>> bool(np.isclose(a["probability"], p))
+    True
+    >>> assert round(float(f.distance_probability[3].sum()), 9) == 1.0
+    """
+    symbols = valid_symbols()
+    tasks = [
+        (phase, symbols[start:start + block_size], max_errors)
+        for phase in phases
+        for start in range(0, len(symbols), block_size)]
+
+    if processes == 0:
+        results = [_search(t) for t in tasks]
+    else:
+        with Pool(processes) as pool:
+            results = pool.map(_search, tasks)
+
+    probability = np.zeros((PHASES, WINDOW_BITS + 1))
+    for (phase, _, _), (_, histogram) in zip(tasks, results):
+        probability[phase] += histogram
+    aliases = np.concatenate([a for a, _ in results])
+    aliases = aliases[np.argsort(aliases, order=["distance", "phase", "a", "b", "c"])]
+    return FalseLocks(aliases, probability)
+
+
+def false_pair_probability(false_locks, bit_error_rate):
+    """Estimate the chance of a false control token pair per window.
+
+    Returns a PHASES array, for each phase the probability that a window
+    of random active video reads as a control token pair given independent
+    bit errors at bit_error_rate.
+    """
+    distance = np.arange(WINDOW_BITS + 1)
+    p_errors = bit_error_rate ** distance * (1 - bit_error_rate) ** (WINDOW_BITS - distance)
+    return false_locks.distance_probability @ p_errors
+
+
+def confirmations_needed(false_locks, bit_error_rate, target=1e-12):
+    """Estimate how many control token pairs at the same phase are needed
+    before the chance of it being a false lock is below target.
+
+    Assumes each window is independent, so this is only a guide for
+    LockTracker's `acquire`.
+
+    >>> f = search(phases=range(1, 3), processes=0)
+    >>> confirmations_needed(f, 0)
+    1
+    """
+    worst = float(false_pair_probability(false_locks, bit_error_rate)[1:].max())
+    if worst <= target:
+        return 1
+    return int(np.ceil(np.log(target) / np.log(worst)))
+
+
+if __name__ == "__main__":
+    import doctest
+    results = doctest.testmod()
+    assert results.failed == 0
+    assert results.attempted > 0
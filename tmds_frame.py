@@ -0,0 +1,436 @@
+# vim:set ts=4 sw=4 sts=4 expandtab:
+"""
+TMDS Frames
+
+Encoding whole video frames into the symbols sent on the three TMDS data
+channels, the Python version of `get_bits` in vga.h.
+
+Frames are uint8 arrays of shape (v active, h active, 3) holding red, green
+and blue. The output has shape (3, v total, h total), one plane of 10 bit
+symbols per channel;
+ * Channel 0 - Blue, C0/C1 carry HSYNC/VSYNC during blanking.
+ * Channel 1 - Green, C0/C1 are always 0.
+ * Channel 2 - Red, C0/C1 are always 0.
+
+The running disparity is reset during blanking so every line of active
+video starts from Cnt = 0. This means lines (and channels) can be encoded
+independently, which FramePool uses to spread a frame over a process pool.
+"""
+
+import os
+from collections import namedtuple, OrderedDict
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from tmds_encoder import TMDSEncoder, encode_control
+
+
+CHANNELS = 3
+
+# Index into the RGB pixel for each channel
+CHANNEL_COLOUR = (2, 1, 0)
+
+
+def sync_levels(signal):
+    """Return the sync level for each position of a ScanSignal.
+
+    The pulse is at the level given by its polarity, everywhere else is at
+    the other level.
+
+    >>> from vga import ScanSignal, Pulse
+    >>> sync_levels(ScanSignal(4, 8, (5, 7, Pulse.POSITIVE))).tolist()
+    [0, 0, 0, 0, 0, 1, 1, 0]
+    >>> sync_levels(ScanSignal(4, 8, (5, 7, Pulse.NEGATIVE))).tolist()
+    [1, 1, 1, 1, 1, 0, 0, 1]
+    """
+    pulse = signal.pulse
+    positions = np.arange(signal.total)
+    in_pulse = (positions >= pulse.start) & (positions < pulse.end)
+    return np.where(in_pulse, pulse.polarity, 1 - pulse.polarity).astype(np.uint8)
+
+
+BlankingTemplate = namedtuple("BlankingTemplate", ["lines", "frame"])
+
+
+def build_blanking_template(timing):
+    """Build the control symbols which are the same in every frame.
+
+    lines - (2, CHANNELS, h total) array, a whole line of blanking for
+            VSYNC at 0 and at 1.
+    frame - (CHANNELS, v total, h total) array with all the blanking of a
+            frame filled in (and 0 in the active video).
+    """
+    hsync = sync_levels(timing.h)
+    vsync = sync_levels(timing.v)
+
+    lines = np.empty((2, CHANNELS, timing.h.total), dtype=np.uint16)
+    for level in (0, 1):
+        lines[level, 0] = np.where(hsync, encode_control(1, level), encode_control(0, level))
+        lines[level, 1:] = encode_control(0, 0)
+
+    frame = lines[vsync].transpose(1, 0, 2).copy()
+    frame[:, :timing.v.active, :timing.h.active] = 0
+
+    for a in (lines, frame):
+        a.flags.writeable = False
+    return BlankingTemplate(lines, frame)
+
+
+# Blanking templates for each vga.Timing used so far
+_blanking_templates = {}
+
+def blanking_template(timing):
+    """Return the (cached) BlankingTemplate for a vga.Timing.
+
+    >>> from vga import Timing, ScanSignal, Pulse
+    >>> timing = Timing(
+    ...     25000000,
+    ...     ScanSignal(4, 8, (5, 7, Pulse.POSITIVE)),
+    ...     ScanSignal(2, 5, (3, 4, Pulse.NEGATIVE)),
+    ...     )
+    >>> t = blanking_template(timing)
+    >>> assert blanking_template(timing) is t
+    >>> t.frame.shape
+    (3, 5, 8)
+    >>> assert (t.frame[:, 3] == t.lines[0]).all() and (t.frame[:, 4] == t.lines[1]).all()
+    """
+    template = _blanking_templates.get(timing)
+    if template is None:
+        template = build_blanking_template(timing)
+        _blanking_templates[timing] = template
+    return template
+
+
+def changed_lines(frame, previous):
+    """Return a (CHANNELS, v active) bool array of the lines which differ.
+
+    >>> a = np.zeros((3, 4, 3), dtype=np.uint8)
+    >>> b = a.copy()
+    >>> b[1, 2, 0] = 1
+    >>> changed_lines(b, a).astype(int).tolist()
+    [[0, 0, 0], [0, 0, 0], [0, 1, 0]]
+    """
+    diff = (np.asarray(frame) != np.asarray(previous)).any(axis=1)
+    return diff[:, CHANNEL_COLOUR].T
+
+
+class LineCache:
+    """LRU cache of encoded lines of active video, keyed by their pixels.
+
+    As the running disparity is reset for every line, the symbols for a
+    line of one channel only depend on its pixel bytes, so a line which has
+    been seen before (in any channel or frame) doesn't need encoding again.
+
+    The pixel bytes themselves are the key, so a hash collision can't return
+    the wrong line. At most max_lines lines are kept, which is about
+    `3 * h active * max_lines` bytes.
+
+    >>> c = LineCache(max_lines=2)
+    >>> a = c.encode(np.zeros(8, dtype=np.uint8))
+    >>> b = c.encode(np.full(8, 0x10, dtype=np.uint8))
+    >>> assert c.encode(np.zeros(8, dtype=np.uint8)) is a
+    >>> c.hits, c.misses
+    (1, 2)
+    >>> _ = c.encode(np.ones(8, dtype=np.uint8))
+    >>> len(c), c.encode(np.full(8, 0x10, dtype=np.uint8)) is b
+    (2, False)
+    """
+
+    def __init__(self, max_lines=4096):
+        assert max_lines > 0
+        self.max_lines = max_lines
+        self.hits = 0
+        self.misses = 0
+        self._lines = OrderedDict()
+
+    def __len__(self):
+        return len(self._lines)
+
+    def clear(self):
+        self._lines.clear()
+
+    def encode(self, pixels):
+        """Return the (read only) symbols for a line of pixel bytes."""
+        key = np.ascontiguousarray(pixels, dtype=np.uint8).tobytes()
+        symbols = self._lines.get(key)
+        if symbols is not None:
+            self.hits += 1
+            self._lines.move_to_end(key)
+            return symbols
+
+        self.misses += 1
+        symbols = TMDSEncoder().encode_runs(np.frombuffer(key, dtype=np.uint8))
+        symbols.flags.writeable = False
+        self._lines[key] = symbols
+        if len(self._lines) > self.max_lines:
+            self._lines.popitem(last=False)
+        return symbols
+
+
+class FrameEncoder:
+    """Encode frames for a vga.Timing.
+
+    >>> from vga import Timing, ScanSignal, Pulse
+    >>> timing = Timing(
+    ...     25000000,
+    ...     ScanSignal(4, 8, (5, 7, Pulse.POSITIVE)),
+    ...     ScanSignal(2, 5, (3, 4, Pulse.NEGATIVE)),
+    ...     )
+    >>> frame = np.arange(4 * 2 * 3, dtype=np.uint8).reshape(2, 4, 3) * 10
+    >>> e = FrameEncoder(timing)
+    >>> symbols = e.encode(frame)
+    >>> symbols.shape
+    (3, 5, 8)
+
+    Each line of active video is encoded from Cnt = 0.
+    >>> line = TMDSEncoder().encode_array(frame[1, :, 2])
+    >>> assert (symbols[0, 1, :4] == line).all()
+
+    Blanking carries HSYNC (C0) and VSYNC (C1) on channel 0 only.
+    >>> hsync = [encode_control(0, 1), encode_control(1, 1)]
+    >>> [hsync.index(s) for s in symbols[0, 0, 4:].tolist()]
+    [0, 1, 1, 0]
+    >>> symbols[0, 3].tolist() == [encode_control(0, 0)] * 5 + [encode_control(1, 0)] * 2 + [encode_control(0, 0)]
+    True
+    >>> assert (symbols[1:, 2:] == encode_control(0, 0)).all()
+
+    Lines can also be streamed one at a time, for frames which don't fit in
+    memory.
+    >>> lines = list(e.lines(frame))
+    >>> [v for v, _ in lines]
+    [0, 1, 2, 3, 4]
+    >>> assert all((l == symbols[:, v]).all() for v, l in lines)
+
+    With a LineCache repeated lines are only encoded once.
+    >>> e = FrameEncoder(timing, cache=LineCache())
+    >>> flat = np.zeros_like(frame)
+    >>> assert (e.encode(flat) == FrameEncoder(timing).encode(flat)).all()
+    >>> e.cache.hits, e.cache.misses
+    (5, 1)
+    """
+
+    def __init__(self, timing, cache=None):
+        self.timing = timing
+        self.template = blanking_template(timing)
+        self.cache = cache
+
+    @property
+    def shape(self):
+        """Shape of the symbols for a whole frame."""
+        return (CHANNELS, self.timing.v.total, self.timing.h.total)
+
+    def encode_line(self, v, pixels=None, out=None):
+        """Encode line v of the frame.
+
+        pixels is the (h active, 3) line of RGB pixels, only needed for
+        lines of active video. Returns (or fills in) a (CHANNELS, h total)
+        uint16 array.
+        """
+        h_active = self.timing.h.active
+        if out is None:
+            out = np.empty((CHANNELS, self.timing.h.total), dtype=np.uint16)
+
+        out[:] = self.template.frame[:, v]
+        if v < self.timing.v.active:
+            pixels = np.asarray(pixels, dtype=np.uint8)
+            assert pixels.shape == (h_active, 3), pixels.shape
+            for channel in range(CHANNELS):
+                self.encode_active(pixels[None], channel, out[None, channel, :h_active])
+        return out
+
+    def encode_active(self, pixels, channel, out):
+        """Encode the active video of one channel for a block of lines.
+
+        pixels is a (lines, h active, 3) array of RGB pixels, out the
+        (lines, h active) array for the symbols.
+        """
+        colour = CHANNEL_COLOUR[channel]
+        for line, symbols in zip(pixels, out):
+            if self.cache is not None:
+                symbols[:] = self.cache.encode(line[:, colour])
+            else:
+                symbols[:] = TMDSEncoder().encode_runs(line[:, colour])
+
+    def lines(self, frame):
+        """Yield (v, symbols) for every line of a frame, see encode_line.
+
+        frame only needs to support indexing by line, so it can be a
+        np.memmap or generate lines on demand. The vertical blanking lines
+        are read only views of the blanking template.
+        """
+        for v in range(self.timing.v.active):
+            yield v, self.encode_line(v, frame[v])
+        for v in range(self.timing.v.active, self.timing.v.total):
+            yield v, self.template.frame[:, v]
+
+    def encode(self, frame, out=None):
+        """Encode a whole frame.
+
+        Returns (or fills in) a uint16 array of shape `self.shape`.
+        """
+        frame = np.asarray(frame, dtype=np.uint8)
+        assert frame.shape == (self.timing.v.active, self.timing.h.active, 3), frame.shape
+        if out is None:
+            out = np.empty(self.shape, dtype=np.uint16)
+        assert out.shape == self.shape, out.shape
+
+        v_active, h_active = self.timing.v.active, self.timing.h.active
+        out[:] = self.template.frame
+        for channel in range(CHANNELS):
+            self.encode_active(frame, channel, out[channel, :v_active, :h_active])
+        return out
+
+    def encode_changes(self, frame, previous, previous_symbols, out=None):
+        """Encode a frame given the previous frame and its symbols.
+
+        Only the lines (of each channel) which have changed are encoded, the
+        rest are copied from previous_symbols. If nothing has changed
+        previous_symbols is returned as is.
+
+        out can be previous_symbols, to update it in place.
+
+        >>> from vga import Timing, ScanSignal, Pulse
+        >>> timing = Timing(
+        ...     25000000,
+        ...     ScanSignal(4, 8, (5, 7, Pulse.POSITIVE)),
+        ...     ScanSignal(3, 6, (4, 5, Pulse.POSITIVE)),
+        ...     )
+        >>> e = FrameEncoder(timing)
+        >>> first = np.zeros((3, 4, 3), dtype=np.uint8)
+        >>> symbols = e.encode(first)
+        >>> assert e.encode_changes(first.copy(), first, symbols) is symbols
+        >>> second = first.copy()
+        >>> second[2, 1] = (1, 2, 3)
+        >>> update = e.encode_changes(second, first, symbols)
+        >>> assert (update == e.encode(second)).all()
+        >>> assert (symbols == e.encode(first)).all()
+        >>> assert e.encode_changes(second, first, symbols, out=symbols) is symbols
+        >>> assert (symbols == update).all()
+        """
+        frame = np.asarray(frame, dtype=np.uint8)
+        assert frame.shape == (self.timing.v.active, self.timing.h.active, 3), frame.shape
+        changed = changed_lines(frame, previous)
+        if not changed.any():
+            if out is not None and out is not previous_symbols:
+                out[:] = previous_symbols
+                return out
+            return previous_symbols
+
+        if out is None:
+            out = previous_symbols.copy()
+        elif out is not previous_symbols:
+            out[:] = previous_symbols
+
+        h_active = self.timing.h.active
+        for channel, v in zip(*np.nonzero(changed)):
+            self.encode_active(frame[v:v + 1], channel, out[channel, v:v + 1, :h_active])
+        return out
+
+
+# State of a FramePool worker process
+_worker = None
+
+def _worker_init(timing, frame_name, out_name, cache_lines):
+    global _worker
+    encoder = FrameEncoder(timing)
+    if cache_lines:
+        encoder.cache = LineCache(cache_lines)
+    frame_shm = SharedMemory(name=frame_name)
+    out_shm = SharedMemory(name=out_name)
+    frame = np.ndarray((timing.v.active, timing.h.active, 3), dtype=np.uint8, buffer=frame_shm.buf)
+    out = np.ndarray(encoder.shape, dtype=np.uint16, buffer=out_shm.buf)
+    _worker = (encoder, frame, out, frame_shm, out_shm)
+
+
+def _worker_encode(task):
+    channel, start, end = task
+    encoder, frame, out = _worker[:3]
+    encoder.encode_active(frame[start:end], channel, out[channel, start:end, :encoder.timing.h.active])
+
+
+class FramePool:
+    """Encode frames using a pool of processes.
+
+    The frame and the symbols are kept in shared memory, so only the line
+    ranges go to the workers and nothing comes back. Work is split by
+    channel and by blocks of lines.
+
+    If cache_lines is given each worker keeps a LineCache of that size.
+
+    >>> from vga import Timing, ScanSignal, Pulse
+    >>> timing = Timing(
+    ...     25000000,
+    ...     ScanSignal(16, 20, (17, 18, Pulse.POSITIVE)),
+    ...     ScanSignal(12, 15, (13, 14, Pulse.POSITIVE)),
+    ...     )
+    >>> frame = np.random.default_rng(1).integers(0, 256, (12, 16, 3), dtype=np.uint8)
+    >>> expected = FrameEncoder(timing).encode(frame)
+    >>> with FramePool(timing, processes=2) as pool:
+    ...     assert (pool.encode(frame) == expected).all()
+    ...     assert (pool.encode(frame[::-1]) == FrameEncoder(timing).encode(frame[::-1])).all()
+    >>> with FramePool(timing, processes=2, cache_lines=16) as pool:
+    ...     assert (pool.encode(frame) == expected).all()
+    """
+
+    def __init__(self, timing, processes=None, lines_per_task=None, cache_lines=None):
+        self.encoder = FrameEncoder(timing)
+        if processes is None:
+            processes = os.cpu_count() or 1
+        if lines_per_task is None:
+            # A few tasks per process so they finish at about the same time
+            lines_per_task = max(1, -(-timing.v.active // (4 * processes)))
+        self.lines_per_task = lines_per_task
+
+        frame_size = timing.v.active * timing.h.active * 3
+        self._frame_shm = SharedMemory(create=True, size=max(frame_size, 1))
+        self._out_shm = SharedMemory(create=True, size=2 * int(np.prod(self.encoder.shape)))
+        self._frame = np.ndarray((timing.v.active, timing.h.active, 3), dtype=np.uint8, buffer=self._frame_shm.buf)
+        self.symbols = np.ndarray(self.encoder.shape, dtype=np.uint16, buffer=self._out_shm.buf)
+
+        # Blanking is the same for every frame
+        self.symbols[:] = self.encoder.template.frame
+
+        self._pool = Pool(processes, _worker_init, (timing, self._frame_shm.name, self._out_shm.name, cache_lines))
+
+    def encode(self, frame, out=None):
+        """Encode a frame.
+
+        Returns self.symbols, which is in shared memory so is overwritten by
+        the next encode() and must not be used after close(), or a copy in
+        out.
+        """
+        self._frame[:] = frame
+        v_active = self.encoder.timing.v.active
+        tasks = [
+            (channel, start, min(start + self.lines_per_task, v_active))
+            for channel in range(CHANNELS)
+            for start in range(0, v_active, self.lines_per_task)]
+        self._pool.map(_worker_encode, tasks)
+
+        if out is not None:
+            out[:] = self.symbols
+            return out
+        return self.symbols
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+        del self._frame, self.symbols
+        for shm in (self._frame_shm, self._out_shm):
+            shm.close()
+            shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+if __name__ == "__main__":
+    import doctest
+    results = doctest.testmod()
+    assert results.failed == 0
+    assert results.attempted > 0
@@ -0,0 +1,197 @@
+# vim:set ts=4 sw=4 sts=4 expandtab:
+"""
+Packed TMDS Symbols
+
+Compact storage for arrays of 10 bit symbols.
+
+"packed10" - 4 symbols in every 5 bytes. The symbols form a continuous LSB
+             first bit stream, the same order as `bits()` / `bint()` in
+             bit_utils.py and what a deserializer would see on the wire. A
+             stream of n symbols takes ceil(10 * n / 8) bytes; the padding
+             in the last byte is always less than a symbol, so the count can
+             be recovered from the length.
+
+"packed30" - One symbol from each of the 3 channels in a 32 bit little
+             endian word, channel 0 in bits 0-9, channel 1 in bits 10-19 and
+             channel 2 in bits 20-29. Suitable for FPGA DMA buffers.
+"""
+
+import numpy as np
+
+
+def packed10_size(count):
+    """Number of bytes needed for count symbols.
+
+    >>> packed10_size(4), packed10_size(5), packed10_size(0)
+    (5, 7, 0)
+    """
+    return (10 * count + 7) // 8
+
+
+def pack10(symbols):
+    """Pack an array of symbols into bytes (as a uint8 array).
+
+    >>> from bit_utils import bint
+    >>> pack10([bint([1,0,0,0,0,0,0,0,0,0]), bint([1,1,0,0,0,0,0,0,0,0])]).tolist()
+    [1, 12, 0]
+    >>> pack10([0x3ff] * 4).tolist()
+    [255, 255, 255, 255, 255]
+    """
+    symbols = np.asarray(symbols, dtype=np.uint16).ravel()
+    count = len(symbols)
+
+    groups = np.zeros((count + 3) // 4 * 4, dtype=np.uint64)
+    groups[:count] = symbols & 0x3ff
+    groups = groups.reshape(-1, 4)
+    words = groups[:, 0] | (groups[:, 1] << 10) | (groups[:, 2] << 20) | (groups[:, 3] << 30)
+
+    packed = words.astype('<u8').view(np.uint8).reshape(-1, 8)[:, :5]
+    return packed.ravel()[:packed10_size(count)]
+
+
+def unpack10(data, count=None):
+    """Unpack bytes (at a symbol boundary) into a uint16 array of symbols.
+
+    >>> s = np.arange(0, 1024, 7, dtype=np.uint16)
+    >>> assert (unpack10(pack10(s)) == s).all()
+    >>> unpack10(pack10(s), count=3).tolist()
+    [0, 7, 14]
+    """
+    data = np.frombuffer(data, dtype=np.uint8) if isinstance(data, (bytes, bytearray)) else np.asarray(data, dtype=np.uint8)
+    if count is None:
+        count = len(data) * 8 // 10
+    data = data[:packed10_size(count)]
+
+    padded = np.zeros((len(data) + 4) // 5 * 5, dtype=np.uint8)
+    padded[:len(data)] = data
+    groups = np.zeros((len(padded) // 5, 8), dtype=np.uint8)
+    groups[:, :5] = padded.reshape(-1, 5)
+    words = groups.view('<u8').ravel()
+
+    symbols = np.empty((len(words), 4), dtype=np.uint16)
+    for i in range(4):
+        symbols[:, i] = (words >> np.uint64(10 * i)) & 0x3ff
+    return symbols.ravel()[:count]
+
+
+def unpack_stream(buf, count, bit_offset=0):
+    """Extract count symbols from a LSB first bit stream starting at any bit.
+
+    >>> unpack_stream(np.frombuffer((0x3ff << 3 | 0x155 << 13).to_bytes(3, "little"), np.uint8), 2, 3).tolist()
+    [1023, 341]
+    """
+    pos = bit_offset + 10 * np.arange(count, dtype=np.int64)
+    byte = pos >> 3
+    shift = (pos & 7).astype(np.uint32)
+
+    # Each symbol is spread over at most 3 bytes
+    padded = np.zeros(len(buf) + 2, dtype=np.uint32)
+    padded[:len(buf)] = buf
+    words = padded[byte] | (padded[byte + 1] << 8) | (padded[byte + 2] << 16)
+    return ((words >> shift) & 0x3ff).astype(np.uint16)
+
+
+def pack30(ch0, ch1, ch2):
+    """Pack three channels of symbols into 32 bit words.
+
+    >>> pack30([1], [2], [3]).tolist() == [1 | (2 << 10) | (3 << 20)]
+    True
+    """
+    words = np.asarray(ch0, dtype='<u4') & 0x3ff
+    words |= (np.asarray(ch1, dtype='<u4') & 0x3ff) << 10
+    words |= (np.asarray(ch2, dtype='<u4') & 0x3ff) << 20
+    return words
+
+
+def unpack30(words):
+    """Unpack 32 bit words into a tuple of three channel arrays.
+
+    >>> [c.tolist() for c in unpack30(pack30([1, 4], [2, 5], [3, 1023]))]
+    [[1, 4], [2, 5], [3, 1023]]
+    """
+    words = np.frombuffer(words, dtype='<u4') if isinstance(words, (bytes, bytearray)) else np.asarray(words, dtype='<u4')
+    return tuple(((words >> (10 * i)) & 0x3ff).astype(np.uint16) for i in range(3))
+
+
+class PackedWriter:
+    """Write symbols to a file object in packed10 format.
+
+    Symbols which don't fill a 5 byte group are held until the next write()
+    or close().
+
+    >>> import io
+    >>> f = io.BytesIO()
+    >>> w = PackedWriter(f)
+    >>> for chunk in ([1, 2, 3], [4, 5], [6]):
+    ...     w.write(chunk)
+    >>> w.close()
+    6
+    >>> f.getvalue() == pack10([1, 2, 3, 4, 5, 6]).tobytes()
+    True
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.count = 0
+        self._pending = np.zeros(0, dtype=np.uint16)
+
+    def write(self, symbols):
+        symbols = np.concatenate([self._pending, np.asarray(symbols, dtype=np.uint16).ravel()])
+        whole = len(symbols) // 4 * 4
+        self.fileobj.write(pack10(symbols[:whole]).tobytes())
+        self._pending = symbols[whole:]
+        self.count += whole
+
+    def close(self):
+        """Flush any remaining symbols, returning the total written."""
+        self.fileobj.write(pack10(self._pending).tobytes())
+        self.count += len(self._pending)
+        self._pending = self._pending[:0]
+        return self.count
+
+
+class PackedReader:
+    """Read packed10 symbols from a file object, block_size symbols at a time.
+
+    >>> import io
+    >>> s = np.arange(0, 1024, 3, dtype=np.uint16)
+    >>> blocks = list(PackedReader(io.BytesIO(pack10(s).tobytes()), block_size=100))
+    >>> [len(b) for b in blocks]
+    [100, 100, 100, 42]
+    >>> assert (np.concatenate(blocks) == s).all()
+
+    Short reads (from pipes or sockets) are joined up into whole blocks.
+    >>> class Trickle(io.BytesIO):
+    ...     def read(self, n=-1):
+    ...         return super().read(min(n, 7))
+    >>> blocks = list(PackedReader(Trickle(pack10(s).tobytes()), block_size=100))
+    >>> [len(b) for b in blocks]
+    [100, 100, 100, 42]
+    >>> assert (np.concatenate(blocks) == s).all()
+    """
+
+    def __init__(self, fileobj, block_size=2**20):
+        assert block_size % 4 == 0
+        self.fileobj = fileobj
+        self.block_size = block_size
+
+    def __iter__(self):
+        size = self.block_size // 4 * 5
+        data = bytearray()
+        while True:
+            chunk = self.fileobj.read(size - len(data))
+            if not chunk:
+                break
+            data += chunk
+            if len(data) == size:
+                yield unpack10(bytes(data))
+                data = bytearray()
+        if data:
+            yield unpack10(bytes(data))
+
+
+if __name__ == "__main__":
+    import doctest
+    results = doctest.testmod()
+    assert results.failed == 0
+    assert results.attempted > 0
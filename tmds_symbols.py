@@ -0,0 +1,138 @@
+# vim:set ts=4 sw=4 sts=4 expandtab:
+"""
+TMDS Symbol Properties
+
+A NumPy structured array with one row for every 10 bit symbol (all 1024 of
+them, valid or not), so properties of a symbol are a lookup rather than
+list operations on its bits, and properties of a whole stream of symbols
+are a single gather.
+
+Columns;
+ * symbol        - The symbol itself (the row number).
+ * type          - One of the TMDS_* token types from tmds_decoder.py.
+ * value         - The pixel byte for pixel tokens, `c0 | (c1 << 1)` for
+                   control tokens, otherwise 0.
+ * c0 / c1       - The control values (0 for non-control tokens).
+ * w_ones        - Set bits in the 8 bit data part (bits 0-7, `token.w`).
+ * ones          - Set bits in the whole symbol.
+ * w_transitions - Transitions within the 8 bit data part.
+ * transitions   - Transitions within the whole symbol.
+ * w_bias        - Bias (ones - zeros) of the 8 bit data part.
+ * bias          - Bias of the whole symbol.
+ * xor           - Bit 8, set if q_m was made with XOR rather than XNOR.
+ * invert        - Bit 9, set if the data part was inverted.
+"""
+
+import numpy as np
+
+from bit_arrays import ONES_TABLE, TRANSITIONS_TABLE, BIAS_TABLE
+from tmds_decoder import token_table, TMDS_PIXEL_10b8b, TMDS_CTRL_10b2b
+
+
+SYMBOL_DTYPE = np.dtype([
+    ("symbol", "<u2"),
+    ("type", "u1"),
+    ("value", "u1"),
+    ("c0", "u1"),
+    ("c1", "u1"),
+    ("w_ones", "u1"),
+    ("ones", "u1"),
+    ("w_transitions", "u1"),
+    ("transitions", "u1"),
+    ("w_bias", "i1"),
+    ("bias", "i1"),
+    ("xor", "?"),
+    ("invert", "?"),
+    ])
+
+
+def build_symbol_table():
+    symbols = np.arange(2**10, dtype=np.uint16)
+    w = symbols & 0xff
+    tokens = token_table()
+
+    table = np.zeros(2**10, dtype=SYMBOL_DTYPE)
+    table["symbol"] = symbols
+    table["type"] = tokens >> 8
+    table["value"] = np.where(
+        (tokens >> 8) == TMDS_PIXEL_10b8b, tokens & 0xff,
+        np.where((tokens >> 8) == TMDS_CTRL_10b2b, tokens & 0x3, 0))
+    is_ctrl = table["type"] == TMDS_CTRL_10b2b
+    table["c0"] = np.where(is_ctrl, table["value"] & 1, 0)
+    table["c1"] = np.where(is_ctrl, table["value"] >> 1, 0)
+    table["w_ones"] = ONES_TABLE[w]
+    table["ones"] = ONES_TABLE
+    # The 8 bit transitions ignore the step from bit 7 to bit 8
+    table["w_transitions"] = ONES_TABLE[(w ^ (w >> 1)) & 0x7f]
+    table["transitions"] = TRANSITIONS_TABLE
+    table["w_bias"] = 2 * table["w_ones"].astype(np.int8) - 8
+    table["bias"] = BIAS_TABLE
+    table["xor"] = (symbols >> 8) & 1
+    table["invert"] = symbols >> 9
+    return table
+
+
+_symbol_table = None
+
+def symbol_table():
+    """Return the symbol property table (see the module docstring).
+
+    >>> t = symbol_table()
+    >>> row = t[0b0111110000]
+    >>> int(row["type"]) == TMDS_PIXEL_10b8b, int(row["value"]), int(row["bias"]), int(row["transitions"])
+    (True, 16, 0, 2)
+    >>> row = t[0b1101010100]
+    >>> int(row["type"]) == TMDS_CTRL_10b2b, int(row["c0"]), int(row["c1"]), int(row["w_transitions"]), bool(row["invert"])
+    (True, 0, 0, 6, True)
+
+    Built (once) on first use.
+    """
+    global _symbol_table
+    if _symbol_table is None:
+        _symbol_table = build_symbol_table()
+        _symbol_table.flags.writeable = False
+    return _symbol_table
+
+
+def select(**conditions):
+    """Return the symbols (as a uint16 array) matching all the conditions.
+
+    Each condition is a column name with either a value to match or an
+    inclusive (low, high) range.
+
+    All the pixel symbols with a bias of +2 and at most 3 transitions;
+    >>> s = select(type=TMDS_PIXEL_10b8b, bias=2, transitions=(0, 3))
+    >>> len(s)
+    23
+    >>> t = symbol_table()[s]
+    >>> assert (t["bias"] == 2).all() and (t["transitions"] <= 3).all()
+
+    >>> len(select(type=TMDS_CTRL_10b2b))
+    4
+    """
+    table = symbol_table()
+    match = np.ones(len(table), dtype=bool)
+    for column, condition in conditions.items():
+        if isinstance(condition, tuple):
+            low, high = condition
+            match &= (table[column] >= low) & (table[column] <= high)
+        else:
+            match &= table[column] == condition
+    return table["symbol"][match]
+
+
+def properties(symbols):
+    """Return the table rows for an array of symbols.
+
+    >>> p = properties([0b1111111111, 0b0000000010, 0b1111111111])
+    >>> p["bias"].tolist(), int(p["bias"].sum())
+    ([10, -8, 10], 12)
+    """
+    return symbol_table()[np.asarray(symbols, dtype=np.uint16) & 0x3ff]
+
+
+if __name__ == "__main__":
+    import doctest
+    results = doctest.testmod()
+    assert results.failed == 0
+    assert results.attempted > 0
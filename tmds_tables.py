@@ -2,6 +2,7 @@
 
 from bit_utils import *
 import tmds_tokens
+from tmds_symbols import symbol_table
 
 def main(args):
     print("""
@@ -12,7 +13,10 @@ def main(args):
                  |----|----||------|-----------|----|----|----|------||-------------------------|----|----|----|------|
 """, end="")
 
+    table = symbol_table()
+
     for token in tmds_tokens.ControlToken.tokens():
+        row = table[int(token)]
         print("""\
                  |  {c0} | {c1}  ||      | {q_m}  |  {q_m_ones} | {q_m_zeros}  |  {q_m_trans} | {q_m_bias: 4} || {encoding:^23s} |  {e_ones} | {e_zeros}  |  {e_trans} | {e_bias: 4} |
 """.format(
@@ -22,16 +26,16 @@ def main(args):
         # q_m info
         q_m=bstr(token.w),
         q_m_op=token.op,
-        q_m_ones=ones(token.w),
-        q_m_zeros=zeros(token.w),
-        q_m_trans=transitions(token.w),
-        q_m_bias=bias(token.w),
+        q_m_ones=int(row["w_ones"]),
+        q_m_zeros=8 - int(row["w_ones"]),
+        q_m_trans=int(row["w_transitions"]),
+        q_m_bias=int(row["w_bias"]),
         # Encoded info
         encoding=bstr(token),
-        e_ones=ones(token),
-        e_zeros=zeros(token),
-        e_trans=transitions(token),
-        e_bias=bias(token),
+        e_ones=int(row["ones"]),
+        e_zeros=10 - int(row["ones"]),
+        e_trans=int(row["transitions"]),
+        e_bias=int(row["bias"]),
         ),
             end="")
 
@@ -42,6 +46,7 @@ def main(args):
 """, end="")
     last_token = None
     for token in tmds_tokens.DataToken.tokens():
+        row = table[int(token)]
         if last_token and last_token.invert() == token:
             print("""\
 |     |          |    |    ||      |           |    |    |    |      |""",
@@ -52,15 +57,15 @@ def main(args):
                     # Token data
                     data=token.data,
                     data_bin=bstr(token.bdata),
-                    data_ones=ones(token.bdata),
-                    data_zeros=zeros(token.bdata),
+                    data_ones=ones_int(token.data),
+                    data_zeros=zeros_int(token.data, 8),
                     # q_m info
                     q_m=bstr(token.w),
                     q_m_op=token.op,
-                    q_m_ones=ones(token.w),
-                    q_m_zeros=zeros(token.w),
-                    q_m_trans=transitions(token.w),
-                    q_m_bias=bias(token.w),
+                    q_m_ones=int(row["w_ones"]),
+                    q_m_zeros=8 - int(row["w_ones"]),
+                    q_m_trans=int(row["w_transitions"]),
+                    q_m_bias=int(row["w_bias"]),
                     ),
                 end="")
 
@@ -69,10 +74,10 @@ def main(args):
 | {encoding:^23s} | {e_ones:2} | {e_zeros:^2} |  {e_trans} | {e_bias: 4} |""".format(
                 # Encoded info
                 encoding=bstr(token),
-                e_ones=ones(token),
-                e_zeros=zeros(token),
-                e_trans=transitions(token),
-                e_bias=bias(token),
+                e_ones=int(row["ones"]),
+                e_zeros=10 - int(row["ones"]),
+                e_trans=int(row["transitions"]),
+                e_bias=int(row["bias"]),
                 ),
             end="")
 
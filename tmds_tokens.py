@@ -6,8 +6,12 @@ TMDS Tokens
  * Data Tokens (10b8b)
  * (TODO) TEARC Tokens (10b4b)
 
+The tokens are generated the first time they are needed rather than on
+import.
 """
 
+from collections import namedtuple
+
 from bit_utils import *
 
 def grouper(iterable, n, fill=None):
@@ -39,7 +43,7 @@ def grouper(iterable, n, fill=None):
         yield tuple(out)
 
 
-class BitSequence(tuple):
+class BitSequence:
     """
     >>> a8 = BitSequence(0)
     >>> a8
@@ -100,35 +104,89 @@ class BitSequence(tuple):
     '0b0100000000'
     >>> c10.__hex__()
     '0x100'
+
+    Stored as an int, but works like a sequence of bits.
+    >>> c10[8], c10[-1], c10[6:9], len(c10), list(c10)[8]
+    (1, 0, (0, 0, 1), 10, 1)
+    >>> assert c10 == BitSequence([0, 0, 0, 0, 0, 0, 0, 0, 1, 0], n=10)
+    >>> assert c10 != c8
+    >>> assert hash(c10) == hash(256)
+
+    With __slots__ (and no tuple base) pickling needs __reduce__, which
+    sends just the class, value and n.
+    >>> import pickle
+    >>> assert pickle.loads(pickle.dumps(c10)) == c10
+    >>> assert pickle.loads(pickle.dumps([c8, c10])) == [c8, c10]
     """
-    # FIXME: Finish this...
+    __slots__ = ("value", "n")
+
     def __new__(cls, *args, n=8):
         if len(args) == 1 and isinstance(args[0], (list, tuple)):
             args = args[0]
+            assert len(args) == n, (len(args), n)
+            i = bint(args)
         else:
             i = args[0]
             assert isinstance(i, int)
             assert i >= 0
             assert i < 2**n
 
-            args = bits(i, n)
-
-        assert len(args) == n, (len(args), n)
-
-        o = tuple.__new__(cls, args)
-        o.value = bint(args)
+        o = object.__new__(cls)
+        o.value = i
         o.n = n
         return o
 
     def __int__(self):
         return self.value
 
+    def __index__(self):
+        return self.value
+
+    def __len__(self):
+        return self.n
+
+    def __iter__(self):
+        v = self.value
+        for i in range(self.n):
+            yield (v >> i) & 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return tuple(self)[i]
+        if i < 0:
+            i += self.n
+        if not 0 <= i < self.n:
+            raise IndexError(i)
+        return (self.value >> i) & 1
+
+    def __eq__(self, other):
+        if not isinstance(other, BitSequence):
+            return NotImplemented
+        return self.value == other.value and self.n == other.n
+
+    def __ne__(self, other):
+        if not isinstance(other, BitSequence):
+            return NotImplemented
+        return self.value != other.value or self.n != other.n
+
+    def __hash__(self):
+        return hash(self.value)
+
+    def __reduce__(self):
+        return (_unpickle, (self.__class__, self.value, self.n))
+
+    def __repr__(self):
+        return repr(tuple(self))
+
     def __bin__(self):
-        return "0b"+"".join(str(b) for b in reversed(self))
+        return "0b{:0{n}b}".format(self.value, n=self.n)
 
     def __hex__(self):
-        nibbles = [BitSequence(g, n=4) for g in list(grouper(self, 4, fill=0))]
-        return "0x"+"".join(hex(int(n))[2:] for n in reversed(nibbles))
+        return "0x{:0{n}x}".format(self.value, n=(self.n + 3) // 4)
+
+
+def _unpickle(cls, value, n):
+    return BitSequence.__new__(cls, value, n=n)
 
 # --
 
@@ -173,15 +231,35 @@ class TMDSToken(BitSequence):
     >>> assert t2.x == 1
     >>> assert t2.i == 0
 
-    >>> TMDSToken._encoding_mapping.clear()
-    >>> TMDSToken._encoding_mapping
-    {}
+    >>> # Tokens can also be created from their int value
+    >>> assert TMDSToken(0b1111111111) is t1
+    >>> assert t1.value == 0b1111111111
+    >>> t1[8], t1[9], t1.op
+    (1, 1, 'XOR')
+
+    >>> # Every symbol has exactly one token object
+    >>> len(TMDSToken._registry)
+    1024
+    >>> assert TMDSToken.lookup(0b1111111111) is t1
+    >>> TMDSToken.lookup(0b0000001010)
+    ErrorToken((0, 1, 0, 1, 0, 0, 0, 0, 0, 0), )
+
+    >>> # Pickled as just the symbol value, and still interned when loaded
+    >>> import pickle
+    >>> assert pickle.loads(pickle.dumps(t1)) is t1
+    >>> assert pickle.loads(pickle.dumps(ControlToken.mapping(0, 1))).c1 == 1
     """
 
-    _encoding_mapping = {}
+    __slots__ = ()
+
+    # Interned tokens, indexed by their 10 bit value. Filled in by
+    # _populate() on first use and then frozen into a tuple.
+    _registry = None
 
     def __new__(cls, b0, b1=None, b2=None, b3=None, b4=None, b5=None, b6=None, b7=None, x=None, i=None):
-        if b1 is None:
+        if b1 is None and isinstance(b0, int):
+            value = b0
+        elif b1 is None:
             assert b0 is not None
             assert b1 is None
             assert b2 is None
@@ -193,37 +271,52 @@ class TMDSToken(BitSequence):
             assert x is None
             assert i is None
             assert len(b0) == 10, len(b0)
-            b0, b1, b2, b3, b4, b5, b6, b7, x, i = b0
+            value = bint(list(b0))
+        else:
+            value = bint([b0, b1, b2, b3, b4, b5, b6, b7, x, i])
+        assert 0 <= value < 2**10, value
+
+        registry = TMDSToken._registry
+        if registry is None:
+            registry = _tokens()
 
-        seq = (b0, b1, b2, b3, b4, b5, b6, b7, x, i)
-        if seq not in cls._encoding_mapping:
-            cls._encoding_mapping[seq] = BitSequence.__new__(cls, seq, n=10)
+        obj = registry[value]
+        if obj is None:
+            obj = BitSequence.__new__(cls, value, n=10)
+            registry[value] = obj
 
-        obj = cls._encoding_mapping[seq]
-        assert isinstance(obj, cls), (cls, seq, obj, cls._encoding_mapping)
+        assert isinstance(obj, cls), (cls, value, obj)
         return obj
 
+    def __reduce__(self):
+        return (_unpickle_token, (self.value,))
+
     def extra(self):
         return {}
 
+    @classmethod
+    def lookup(cls, symbol):
+        """Return the token for a 10 bit symbol value."""
+        return _tokens()[symbol]
+
     @classmethod
     def rmapping(cls, bits):
         assert len(bits) == 10
-        obj = TMDSToken(bits)
+        obj = _tokens()[bint(list(bits))]
         assert isinstance(obj, cls)
         return obj
 
     @property
     def w(self):
-        return self[:-2]
+        return tuple(bits(self.value & 0xff))
 
     @property
     def x(self):
-        return self[-2]
+        return (self.value >> 8) & 1
 
     @property
     def i(self):
-        return self[-1]
+        return self.value >> 9
 
     @property
     def op(self):
@@ -251,8 +344,9 @@ class TMDSToken(BitSequence):
     def invert(self):
         """Invert the TMDS Token to the alternative.
 
+        If the alternative isn't a valid symbol an ErrorToken is returned.
         """
-        return self.__class__(inv(self[:-2])+[self.x]+inv([self.i]), **self.extra())
+        return _tokens()[self.value ^ 0b1011111111]
 
 # --
 
@@ -267,6 +361,8 @@ class ControlToken(TMDSToken):
     >>> assert token1 != token2
     """
 
+    __slots__ = ("c0", "c1")
+
     _control_mapping = {}
 
     def __new__(cls, *args, c0=None, c1=None):
@@ -285,6 +381,7 @@ class ControlToken(TMDSToken):
 
     @classmethod
     def mapping(cls, c0, c1):
+        _tokens()
         return cls._control_mapping[(c0, c1)]
 
     @classmethod
@@ -294,10 +391,6 @@ class ControlToken(TMDSToken):
         yield ControlToken([0,0,1,0,1,0,1,0,1,0], c0=0, c1=1)
         yield ControlToken([1,1,0,1,0,1,0,1,0,1], c0=1, c1=1)
 
-# Register the Data Tokens
-for t in ControlToken.tokens():
-    pass
-
 # --
 
 class DataToken(TMDSToken):
@@ -314,8 +407,15 @@ class DataToken(TMDSToken):
     DataToken((0, 0, 0, 0, 1, 1, 1, 1, 1, 0), data=0x10)
     >>> DataToken.rmapping((1, 1, 1, 1, 1, 1, 1, 1, 1, 1))
     DataToken((1, 1, 1, 1, 1, 1, 1, 1, 1, 1), data=0x0)
+    >>> # The negative and positive bias encodings of a byte. The encoder
+    >>> # sends the negative one when Cnt is positive and vice versa.
+    >>> DataToken.choice(0x00)
+    EncodedChoice(negative=DataToken((0, 0, 0, 0, 0, 0, 0, 0, 1, 0), data=0x00), positive=DataToken((1, 1, 1, 1, 1, 1, 1, 1, 1, 1), data=0x00))
+    >>> assert DataToken.choice(0x10).negative is DataToken.choice(0x10).positive
     """
 
+    __slots__ = ("data",)
+
     _data_mapping = {}
 
     def __new__(cls, *args, data=None):
@@ -341,15 +441,30 @@ class DataToken(TMDSToken):
     @classmethod
     def tokens(cls):
         """
+        >>> len(list(DataToken.tokens()))
+        460
         """
         for i in range(0, 256):
-            for token in cls.generate_tokens(i):
+            for token in sorted(cls.mapping(i), key=lambda t: t.i):
                 yield token
 
     @classmethod
     def mapping(cls, data):
+        _tokens()
         return cls._data_mapping[data]
 
+    @classmethod
+    def choice(cls, data):
+        """Return the EncodedChoice(negative, positive) bias encodings of a
+        byte, see tmds_pixel_to_encoded in tmds.h.
+
+        >>> c = DataToken.choice(0x00)
+        >>> bias(c.negative), bias(c.positive)
+        (-8, 10)
+        """
+        _tokens()
+        return cls._pixel_to_encoded[data]
+
     # --------------------------------------------------------------------
 
     @property
@@ -441,7 +556,8 @@ class DataToken(TMDSToken):
 
             assert len(encodings) == 2
 
-        encodings = list(encodings)
+        # Straight encoding first, so the order doesn't depend on hashing.
+        encodings = sorted(encodings, key=lambda t: t.i)
 
         assert len(encodings) in (1, 2)
 
@@ -452,14 +568,76 @@ class DataToken(TMDSToken):
 
         return list(encodings)
 
-# Register the Data Tokens
-for t in DataToken.tokens():
-    pass
-
 # --
 
 class ErrorToken(TMDSToken):
-    pass
+    __slots__ = ()
+
+# --
+
+def _unpickle_token(value):
+    return _tokens()[value]
+
+
+def pack_tokens(tokens):
+    """Return a sequence of tokens as a uint16 array of their symbols.
+
+    The array (or its bytes) is much cheaper to send between processes than
+    the tokens themselves, see unpack_tokens().
+
+    >>> pack_tokens([ControlToken.mapping(0, 0), DataToken.choice(0x10).positive]).tolist()
+    [852, 496]
+    """
+    import numpy as np
+    return np.fromiter((t.value for t in tokens), dtype=np.uint16)
+
+
+def unpack_tokens(symbols):
+    """Return the (interned) tokens for an array of symbols.
+
+    >>> symbols = pack_tokens(DataToken.tokens())
+    >>> assert unpack_tokens(symbols) == list(DataToken.tokens())
+    >>> assert unpack_tokens(symbols.tobytes())[0] is next(DataToken.tokens())
+    """
+    import numpy as np
+    if isinstance(symbols, (bytes, bytearray)):
+        symbols = np.frombuffer(symbols, dtype=np.uint16)
+    registry = _tokens()
+    return [registry[s] for s in np.asarray(symbols, dtype=np.uint16).tolist()]
+
+# --
+
+EncodedChoice = namedtuple("EncodedChoice", ["negative", "positive"])
+
+def _pixel_to_encoded(data):
+    """Same as tmds_pixel_to_encoded in tmds.h"""
+    tokens = sorted(DataToken._data_mapping[data], key=bias)
+    return EncodedChoice(tokens[0], tokens[-1])
+
+# --
+
+def _populate():
+    TMDSToken._registry = [None] * 2**10
+    for t in ControlToken.tokens():
+        pass
+    for i in range(0, 256):
+        DataToken.generate_tokens(i)
+
+    # Every other symbol is forbidden
+    for symbol, token in enumerate(TMDSToken._registry):
+        if token is None:
+            ErrorToken(symbol)
+    DataToken._pixel_to_encoded = tuple(_pixel_to_encoded(i) for i in range(256))
+
+    TMDSToken._registry = tuple(TMDSToken._registry)
+
+
+def _tokens():
+    """Return the token registry, filling it in on first use."""
+    if TMDSToken._registry is None:
+        _populate()
+    return TMDSToken._registry
+
 
 # --
 